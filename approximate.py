@@ -0,0 +1,205 @@
+"""
+Приблизительные ответы по сэмплам таблицы
+"""
+import math
+import re
+from typing import List, Dict, Optional, Tuple
+from logger import logger
+from config import settings
+from database import db, ResultSet
+
+SAMPLE_ROWS_COLUMN = "__sample_rows"
+
+# Агрегаты, которые масштабируются линейно по доле сэмпла
+_SCALABLE = re.compile(r'\b(COUNT|SUM)\s*\(', re.IGNORECASE)
+
+# Число различных значений по сэмплу не оценивается умножением
+_DISTINCT = re.compile(r'\b(?:COUNT|SUM)\s*\(\s*DISTINCT\b|\bAPPROX_COUNT_DISTINCT\s*\(', re.IGNORECASE)
+
+# FILTER (...) / OVER (...) / OVER w после агрегата - часть того же выражения
+_AGGREGATE_SUFFIX = re.compile(r'\s*(?:FILTER\s*\(|OVER\s*\(|OVER\s+\w+)', re.IGNORECASE)
+
+def _matching_paren(sql: str, open_pos: int) -> int:
+    """Позиция закрывающей скобки для скобки в open_pos"""
+    depth = 0
+    quote = None
+    for i in range(open_pos, len(sql)):
+        ch = sql[i]
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+def scale_aggregates(sql: str, scale: float) -> Tuple[str, List[str]]:
+    """
+    Умножить COUNT(...) и SUM(...) на scale
+
+    COUNT(DISTINCT ...) не масштабируется линейно и остается как есть.
+    FILTER (...) и OVER (...) после агрегата попадают в масштабируемое выражение.
+
+    Returns:
+        (sql, масштабированные функции: "COUNT" / "SUM")
+    """
+    result = []
+    pos = 0
+    scaled = []
+    for match in _SCALABLE.finditer(sql):
+        if match.start() < pos:
+            continue  # агрегат внутри уже обработанного
+        close = _matching_paren(sql, match.end() - 1)
+        if close < 0:
+            break
+        inner = sql[match.end():close]
+        if re.match(r'\s*DISTINCT\b', inner, re.IGNORECASE):
+            continue
+        # Масштабировать вместе с FILTER (...) / OVER (...)
+        while True:
+            suffix = _AGGREGATE_SUFFIX.match(sql, close + 1)
+            if not suffix:
+                break
+            if suffix.group(0).endswith("("):
+                close = _matching_paren(sql, suffix.end() - 1)
+                if close < 0:
+                    raise ValueError("Unbalanced parentheses after aggregate")
+            else:
+                close = suffix.end() - 1
+        result.append(sql[pos:match.start()])
+        result.append(f"({sql[match.start():close + 1]} * {scale!r})")
+        pos = close + 1
+        scaled.append(match.group(1).upper())
+    result.append(sql[pos:])
+    return "".join(result), scaled
+
+def _top_level_from(sql: str) -> int:
+    """Позиция FROM внешнего SELECT (вне скобок и строк)"""
+    depth = 0
+    quote = None
+    for match in re.finditer(r"[()'\"]|\bFROM\b", sql, re.IGNORECASE):
+        token = match.group(0)
+        if quote:
+            if token == quote:
+                quote = None
+        elif token in ("'", '"'):
+            quote = token
+        elif token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0:
+            return match.start()
+    return -1
+
+def _subquery_spans(sql: str) -> List[Tuple[int, int]]:
+    """Границы подзапросов и CTE: (SELECT ...) / (WITH ...)"""
+    spans = []
+    for match in re.finditer(r'\(\s*(?:SELECT|WITH)\b', sql, re.IGNORECASE):
+        close = _matching_paren(sql, match.start())
+        spans.append((match.start(), close if close >= 0 else len(sql)))
+    return spans
+
+def _check_scalable(sql: str):
+    """
+    Оценивать по сэмплу можно, только если COUNT/SUM стоят в SELECT внешнего запроса
+
+    Агрегат внутри подзапроса масштабируется не линейно (AVG(cnt) по сэмплу
+    считает средний размер группы в сэмпле, а не в таблице). COUNT(DISTINCT ...)
+    по сэмплу тоже не оценивается - такой запрос выполняется точно.
+    """
+    if _DISTINCT.search(sql):
+        raise ValueError("COUNT(DISTINCT ...) cannot be estimated from a sample")
+
+    aggregates = list(_SCALABLE.finditer(sql))
+    spans = _subquery_spans(sql)
+    if any(start < m.start() < end for m in aggregates for start, end in spans):
+        raise ValueError("COUNT/SUM inside a subquery cannot be estimated from a sample")
+
+    from_pos = _top_level_from(sql)
+    if not any(from_pos < 0 or m.start() < from_pos for m in aggregates):
+        raise ValueError("Query has no COUNT/SUM aggregates to estimate")
+
+def _inject_sample_rows(sql: str) -> str:
+    """
+    Добавить COUNT(*) по сэмплу в конец списка SELECT
+    (в конец - чтобы не сдвигать GROUP BY 1 / ORDER BY 2)
+    """
+    pos = _top_level_from(sql)
+    if pos < 0:
+        raise ValueError("FROM clause not found")
+    return f"{sql[:pos].rstrip()}, COUNT(*) AS {SAMPLE_ROWS_COLUMN} {sql[pos:]}"
+
+def margin_of_error(sample_rows: int, fraction: float) -> Optional[float]:
+    """
+    Относительная ошибка (95%) оценки COUNT по Bernoulli-сэмплу
+    из sample_rows строк при доле сэмпла fraction
+    """
+    if not sample_rows:
+        return None
+    return round(1.96 * math.sqrt((1 - fraction) / sample_rows), 4)
+
+def pick_sample(rate: float = None) -> Optional[Dict]:
+    """Наименьший доступный сэмпл с долей не меньше rate"""
+    rate = rate or settings.approx_default_rate
+    samples = db.get_samples()
+    for sample_rate in sorted(samples):
+        if sample_rate >= rate:
+            return samples[sample_rate]
+    return None
+
+def execute_approximate(sql: str, sample: Dict) -> Tuple[List[Dict], List[Optional[float]]]:
+    """
+    Выполнить SQL на сэмпле с масштабированием COUNT/SUM
+
+    Ошибка считается только для COUNT: для запросов с SUM она None
+    (зависит от дисперсии значений, а не только от числа строк).
+
+    Returns:
+        (results, относительная ошибка для каждой строки)
+    """
+    _check_scalable(sql)
+    sample_sql = re.sub(rf'\b{re.escape(settings.table_name)}\b', sample["table"], sql)
+    sample_sql, scaled = scale_aggregates(sample_sql, sample["scale"])
+
+    if not scaled:
+        # Только COUNT(DISTINCT ...) - строки сэмпла ничего не оценивают
+        raise ValueError("Query has no COUNT/SUM aggregates to estimate")
+
+    # Названия колонок как в точном ответе (а не "(count_star() * 100.0)")
+    columns = db.query_columns(sql)
+
+    try:
+        results = db.execute_sql(_inject_sample_rows(sample_sql))
+    except Exception as e:
+        # Например, SELECT DISTINCT или UNION - считаем без оценки ошибки
+        logger.debug("Sample row count injection failed: %s", e)
+        return _rename_columns(db.execute_sql(sample_sql), columns), []
+
+    fraction = 1 / sample["scale"]
+    margins = []
+    for row in results:
+        sample_rows = row.pop(SAMPLE_ROWS_COLUMN, None)
+        if "SUM" in scaled:
+            margins.append(None)
+        else:
+            margins.append(margin_of_error(int(sample_rows or 0), fraction))
+
+    # Служебная колонка - последняя
+    if results.columns and results.columns[-1] == SAMPLE_ROWS_COLUMN:
+        results.columns = results.columns[:-1]
+        results.types = results.types[:-1]
+    return _rename_columns(results, columns), margins
+
+def _rename_columns(results: ResultSet, columns: List[str]) -> ResultSet:
+    """Переименовать колонки результата по позиции"""
+    if len(columns) != len(results.columns) or columns == results.columns:
+        return results
+    return ResultSet(columns, results.types, [
+        dict(zip(columns, row.values())) for row in results
+    ])
@@ -0,0 +1,71 @@
+"""
+Single-flight: объединение одинаковых параллельных запросов
+"""
+import asyncio
+import re
+from typing import Any, Callable, Dict
+from starlette.concurrency import run_in_threadpool
+from logger import logger
+from config import settings
+
+def normalize_question(query: str) -> str:
+    """Нормализовать вопрос пользователя для ключа coalescing"""
+    query = " ".join(query.lower().split())
+    return re.sub(r'[\s?!.;,]+$', "", query)
+
+class SingleFlight:
+    """
+    Один вызов на ключ: параллельные запросы с тем же ключом
+    ждут результат уже запущенного вызова
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.calls = 0
+        self.executed = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    async def do(self, key: str, fn: Callable, *args) -> Any:
+        """Выполнить fn(*args) в threadpool или присоединиться к уже запущенному вызову"""
+        self.calls += 1
+
+        if not settings.coalescing_enabled:
+            self.executed += 1
+            return await run_in_threadpool(fn, *args)
+
+        task = self._inflight.get(key)
+        if task is None:
+            # Отдельная задача: отмена первого запроса не ломает остальных
+            task = asyncio.ensure_future(run_in_threadpool(fn, *args))
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+            self._inflight[key] = task
+            self.executed += 1
+        else:
+            self.coalesced += 1
+            logger.debug("🔗 Coalesced %s call (%d in flight)", self.name, len(self._inflight))
+
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Future):
+        """Убрать завершенный вызов из in-flight"""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            self.failed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики coalescing"""
+        return {
+            "calls": self.calls,
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+            "in_flight": len(self._inflight),
+            "saved_ratio": round(self.coalesced / self.calls, 4) if self.calls else 0.0,
+        }
+
+# Глобальные экземпляры
+nlp_flight = SingleFlight("nlp")
+sql_flight = SingleFlight("sql")
@@ -10,11 +10,38 @@ class Settings(BaseSettings):
     # NLP Model
     nlp_model_url: str = "https://nuraly17-futbolchik.hf.space"  
     nlp_timeout: int = 100  # 100 секунд на генерацию SQL
+    nlp_model_urls: List[str] = []  # Дополнительные реплики Space для пула
+    nlp_pool_size: int = 1  # Клиентов на каждый Space URL (по кругу, без эксклюзивного захвата)
+    nlp_breaker_failures: int = 5  # Ошибок подряд до открытия circuit breaker
+    nlp_breaker_reset: int = 30  # Секунд до пробного запроса после открытия
+    nlp_max_retries: int = 2  # Максимум retry на один запрос
+    nlp_retry_budget_ratio: float = 0.2  # Retry не больше ~20% от запросов
+    nlp_hedge_enabled: bool = False  # Дублировать медленный запрос после p95
+    nlp_hedge_min_delay: float = 5.0  # Минимальная задержка перед hedge (секунды)
     
     # Database
     database_path: str = "mastercard.db"
     dataset_path: str = "data/dataset.parquet"
     table_name: str = "example_dataset"
+    duckdb_memory_limit: str = ""  # Например "4GB" (пусто - по умолчанию DuckDB, 80% RAM)
+    duckdb_threads: int = 0  # 0 - по числу ядер
+    duckdb_temp_directory: str = ""  # Куда спиллить при нехватке памяти
+    admission_capacity: int = 8  # Суммарный вес одновременно выполняемых запросов
+    admission_timeout: int = 60  # Секунд ожидания в очереди до отказа
+    prepared_statements: bool = True  # Частые шаблоны SQL через PREPARE / EXECUTE
+    prepared_min_count: int = 2  # С какого повтора шаблона готовить план
+    prepared_cache_size: int = 64  # Планов на поток
+    fingerprint_cache_size: int = 1000  # Шаблонов в статистике /fingerprints (LRU)
+    load_profile: str = "optimized"  # raw | optimized (ENUM, сортировка)
+    enum_max_distinct: int = 256  # Максимум значений для VARCHAR -> ENUM
+    load_parse_dates: bool = False  # optimized: VARCHAR даты -> DATE (ломает сравнения со строкой '12/25')
+    load_narrow_integers: bool = False  # optimized: BIGINT -> INTEGER (возможен overflow в арифметике)
+    lookup_index_columns: List[str] = ["transaction_id", "merchant_id"]  # ART индексы для drill-down ([] - без индексов)
+    catalog_table: str = "schema_catalog"
+    catalog_top_k: int = 100  # Сколько частых значений хранить для автодополнения
+    catalog_max_distinct: int = 1000  # Порог low-cardinality колонки
+    sample_rates: List[float] = [0.001, 0.01, 0.1]  # Сэмплы для approximate режима
+    approx_default_rate: float = 0.01
     
     # CORS
     cors_origins: List[str] = [
@@ -27,9 +54,24 @@ class Settings(BaseSettings):
     max_results: int = 10000  # Максимум строк в ответе
     query_timeout: int = 200   # Максимум секунд на SQL запрос
     
+    # Сжатие ответов
+    gzip_min_size: int = 1024  # Сжимать ответы больше N байт
+    gzip_level: int = 5
+    
+    # Coalescing одинаковых параллельных запросов
+    coalescing_enabled: bool = True
+    
+    # Profiling
+    profile_slow_threshold: float = 0  # Профилировать запросы медленнее N секунд (0 - выключено)
+    
     # Logging
     log_level: str = "INFO"
     log_file: str = "logs/backend.log"
+    log_format: str = "text"  # text | json
+    log_rotation: str = "size"  # size | time
+    log_max_bytes: int = 10 * 1024 * 1024  # Ротация по размеру
+    log_rotation_when: str = "midnight"  # Ротация по времени
+    log_backup_count: int = 7
     
     class Config:
         env_file = ".env"
@@ -2,11 +2,44 @@
 Работа с базой данных DuckDB
 """
 import duckdb
+import hashlib
+import json
 import os
-from typing import List, Dict
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 from logger import logger
 from config import settings
+from validators import sql_pattern, sql_fingerprint, parameterize_sql
+from resilience import WeightedSemaphore
+
+# Операции, которым нужны хеш-таблицы / сортировки в памяти
+_HEAVY_OPERATIONS = [
+    (re.compile(r'\bGROUP\s+BY\b', re.IGNORECASE), 2),
+    (re.compile(r'\bJOIN\b', re.IGNORECASE), 2),
+    (re.compile(r'\bDISTINCT\b', re.IGNORECASE), 1),
+    (re.compile(r'\bORDER\s+BY\b', re.IGNORECASE), 1),
+    (re.compile(r'\bOVER\s*\(', re.IGNORECASE), 1),
+]
+
+class ResultSet(list):
+    """Строки результата (список словарей) + названия и типы колонок DuckDB"""
+
+    def __init__(self, columns: List[str], types: List[str], rows=()):
+        super().__init__(rows)
+        self.columns = columns
+        self.types = types
+
+def estimate_query_weight(sql: str) -> int:
+    """Оценка тяжести запроса по памяти для admission control (1 - простой скан)"""
+    weight = 1
+    for pattern, cost in _HEAVY_OPERATIONS:
+        weight += cost * len(pattern.findall(sql))
+    return weight
 
 class Database:
     """Класс для работы с DuckDB"""
@@ -14,30 +47,53 @@ class Database:
     def __init__(self, db_path: str = None):
         self.db_path = db_path or settings.database_path
         self.conn = None
+        self.catalog = None
+        self.samples = None
+        self.admission = WeightedSemaphore(settings.admission_capacity)
+        self.fingerprints = OrderedDict()
+        self._fingerprint_lock = threading.Lock()
+        self._local = threading.local()
         self._connect()
         self._init_logs_table()
+        self._init_catalog_table()
     
     def _connect(self):
         """Подключиться к базе данных"""
         try:
             # FIX: Используем read_only если не главный процесс
             import os
+            config = self._duckdb_config()
             if os.getenv("UVICORN_WORKER_ID"):
                 # Worker process - read-only
-                self.conn = duckdb.connect(self.db_path, read_only=True)
+                self.conn = duckdb.connect(self.db_path, read_only=True, config=config)
                 logger.info(f"✅ DuckDB connected (read-only): {self.db_path}")
             else:
                 # Main process
-                self.conn = duckdb.connect(self.db_path)
+                self.conn = duckdb.connect(self.db_path, config=config)
                 logger.info(f"✅ DuckDB connected: {self.db_path}")
+            if config:
+                logger.info(f"⚙️ DuckDB settings: {config}")
         except Exception as e:
             logger.error(f"❌ Failed to connect to DuckDB: {e}")
             raise
     
+    def _duckdb_config(self) -> Dict[str, object]:
+        """Ограничения ресурсов DuckDB из настроек"""
+        config = {}
+        if settings.duckdb_memory_limit:
+            config["memory_limit"] = settings.duckdb_memory_limit
+        if settings.duckdb_threads > 0:
+            config["threads"] = settings.duckdb_threads
+        if settings.duckdb_temp_directory:
+            os.makedirs(settings.duckdb_temp_directory, exist_ok=True)
+            config["temp_directory"] = settings.duckdb_temp_directory
+        return config
+    
     def _init_logs_table(self):
         """Создать таблицу для логов"""
         try:
             # Удалить старую таблицу если есть проблемы
+            self.conn.execute("DROP TABLE IF EXISTS query_profiles")
             self.conn.execute("DROP TABLE IF EXISTS query_logs")
             self.conn.execute("DROP SEQUENCE IF EXISTS query_logs_seq")
             
@@ -55,37 +111,93 @@ class Database:
                     success BOOLEAN,
                     error_message TEXT,
                     execution_time FLOAT,
-                    rows_returned INTEGER
+                    rows_returned INTEGER,
+                    sql_pattern TEXT,
+                    sql_fingerprint TEXT
+                )
+            """)
+            
+            # Индексы для фильтров /logs
+            self.conn.execute("CREATE INDEX query_logs_timestamp_idx ON query_logs (timestamp)")
+            self.conn.execute("CREATE INDEX query_logs_time_idx ON query_logs (execution_time)")
+            self.conn.execute("CREATE INDEX query_logs_fingerprint_idx ON query_logs (sql_fingerprint)")
+            
+            # Профили DuckDB для медленных / запрошенных запросов
+            self.conn.execute("""
+                CREATE TABLE query_profiles (
+                    log_id INTEGER PRIMARY KEY,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    sql_pattern TEXT,
+                    db_time FLOAT,
+                    conversion_time FLOAT,
+                    dominant_operator TEXT,
+                    dominant_operators TEXT,
+                    profile TEXT
                 )
             """)
             
             logger.debug("✅ Logs table initialized")
         except Exception as e:
             logger.warning(f"⚠️ Could not create logs table: {e}")
+    
+    def _init_catalog_table(self):
+        """Создать таблицу каталога схемы и статистики колонок"""
+        try:
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {settings.catalog_table} (
+                    version INTEGER,
+                    table_name TEXT,
+                    column_name TEXT,
+                    ordinal INTEGER,
+                    column_type TEXT,
+                    row_count BIGINT,
+                    null_fraction DOUBLE,
+                    min_value TEXT,
+                    max_value TEXT,
+                    approx_distinct BIGINT,
+                    top_values TEXT,
+                    built_at TIMESTAMP
+                )
+            """)
+            logger.debug("✅ Catalog table initialized")
+        except Exception as e:
+            logger.warning(f"⚠️ Could not create catalog table: {e}")
         
-    def load_parquet(self, parquet_file: str = None, table_name: str = None):
-        """Загрузить parquet файл как таблицу"""
+    def load_parquet(self, parquet_file: str = None, table_name: str = None,
+                     profile: str = None):
+        """
+        Загрузить parquet файл как таблицу
+        
+        profile: "raw" - схема parquet как есть,
+                 "optimized" - ENUM для low-cardinality строк, сортировка
+                               (DATE / INTEGER - по LOAD_PARSE_DATES / LOAD_NARROW_INTEGERS)
+        """
         parquet_file = parquet_file or settings.dataset_path
         table_name = table_name or settings.table_name
+        profile = profile or settings.load_profile
         
         if not os.path.exists(parquet_file):
             raise FileNotFoundError(f"Dataset not found: {parquet_file}")
         
-        logger.info(f"📊 Loading dataset from {parquet_file}...")
+        logger.info(f"📊 Loading dataset from {parquet_file} ({profile} profile)...")
         
         try:
             # DuckDB читает parquet напрямую
-            self.conn.execute(f"""
-                CREATE OR REPLACE TABLE {table_name} AS 
-                SELECT * FROM read_parquet('{parquet_file}')
-            """)
+            self._create_table(table_name, parquet_file, profile)
             
-            # Статистика
-            count = self.conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+            # Индексы для drill-down по id
+            self._create_lookup_indexes(table_name)
+            
+            # Каталог схемы и статистики (старая версия инвалидируется)
+            catalog = self.build_catalog(table_name)
+            count = catalog["row_count"]
             logger.info(f"✅ Loaded {count:,} rows into '{table_name}'")
             
             # Показать схему
-            self._log_schema(table_name)
+            self._log_schema(catalog)
+            
+            # Сэмплы для approximate режима
+            self.build_samples(table_name, count)
             
             return count
             
@@ -93,35 +205,503 @@ class Database:
             logger.error(f"❌ Failed to load parquet: {e}")
             raise
     
-    def _log_schema(self, table_name: str):
+    def _create_table(self, table_name: str, parquet_file: str, profile: str):
+        """Создать таблицу из parquet в выбранном профиле"""
+        if profile == "raw":
+            self.conn.execute(f"""
+                CREATE OR REPLACE TABLE {table_name} AS 
+                SELECT * FROM read_parquet('{parquet_file}')
+            """)
+            return
+        
+        if profile != "optimized":
+            raise ValueError(f"Unknown load profile: {profile}")
+        
+        select_list, sort_columns, changes = self._optimized_columns(parquet_file)
+        order_by = f"ORDER BY {', '.join(sort_columns)}" if sort_columns else ""
+        self.conn.execute(f"""
+            CREATE OR REPLACE TABLE {table_name} AS 
+            SELECT {', '.join(select_list)}
+            FROM read_parquet('{parquet_file}')
+            {order_by}
+        """)
+        
+        for column, change in changes.items():
+            logger.info(f"   🗜️ {column:30s} {change}")
+        if sort_columns:
+            logger.info(f"   🗜️ Sorted by {', '.join(sort_columns)}")
+    
+    def _create_lookup_indexes(self, table_name: str):
+        """ART индексы для point lookup (CREATE OR REPLACE TABLE удаляет старые)"""
+        columns = {row[0] for row in self.conn.execute(f"DESCRIBE {table_name}").fetchall()}
+        
+        for column in settings.lookup_index_columns:
+            if column not in columns:
+                logger.warning(f"⚠️ No column '{column}' in '{table_name}', index skipped")
+                continue
+            
+            start = time.time()
+            self.conn.execute(
+                f'CREATE INDEX IF NOT EXISTS {table_name}_{column}_idx ON {table_name} ("{column}")'
+            )
+            logger.info(f"   🔎 Index on {column} built in {time.time() - start:.1f}s")
+    
+    def _optimized_columns(self, parquet_file: str) -> Tuple[List[str], List[str], Dict[str, str]]:
+        """
+        Подобрать компактные типы по статистике parquet
+        
+        Returns:
+            (список SELECT выражений, колонки сортировки, описание изменений)
+        """
+        source = f"read_parquet('{parquet_file}')"
+        summary = self.conn.execute(f"SUMMARIZE SELECT * FROM {source}").fetchall()
+        
+        select_list = []
+        changes = {}
+        enum_columns = []
+        timestamp_column = None
+        
+        for col in summary:
+            name, col_type, min_value, max_value, approx_distinct = col[:5]
+            quoted = f'"{name}"'
+            expression = quoted
+            
+            if col_type == "VARCHAR":
+                # Строка, которая целиком парсится как дата (меняет тип колонки - только по настройке)
+                date_format = None
+                if settings.load_parse_dates:
+                    date_format = self._detect_date_format(source, name, min_value)
+                if date_format:
+                    expression = f"CAST(STRPTIME({quoted}, '{date_format}') AS DATE)"
+                    changes[name] = f"VARCHAR -> DATE ('{date_format}')"
+                
+                elif approx_distinct <= settings.enum_max_distinct * 2:
+                    # Low-cardinality строка -> ENUM (словарь значений, 1-2 байта на строку)
+                    values = [row[0] for row in self.conn.execute(
+                        f"SELECT DISTINCT {quoted} FROM {source} WHERE {quoted} IS NOT NULL ORDER BY 1"
+                    ).fetchall()]
+                    if len(values) <= settings.enum_max_distinct:
+                        literals = ", ".join("'" + v.replace("'", "''") + "'" for v in values)
+                        expression = f"CAST({quoted} AS ENUM({literals}))"
+                        changes[name] = f"VARCHAR -> ENUM ({len(values)} values)"
+                        enum_columns.append((len(values), quoted))
+            
+            elif (col_type in ("BIGINT", "HUGEINT") and min_value is not None
+                  and settings.load_narrow_integers):
+                # Сузить до INTEGER, если все значения помещаются (арифметика INT32 может переполниться)
+                if -2**31 <= int(min_value) and int(max_value) < 2**31:
+                    expression = f"CAST({quoted} AS INTEGER)"
+                    changes[name] = f"{col_type} -> INTEGER"
+            
+            elif col_type.startswith("TIMESTAMP") and timestamp_column is None:
+                timestamp_column = quoted
+            
+            select_list.append(expression if expression == quoted else f"{expression} AS {quoted}")
+        
+        # Сортировка: сначала колонки с наименьшим числом значений (длинные RLE серии), затем время
+        sort_columns = [quoted for _, quoted in sorted(enum_columns)[:3]]
+        if timestamp_column:
+            sort_columns.append(timestamp_column)
+        
+        return select_list, sort_columns, changes
+    
+    def _detect_date_format(self, source: str, column: str, sample_value: str) -> Optional[str]:
+        """Формат даты, по которому парсятся все непустые значения колонки"""
+        if not sample_value:
+            return None
+        
+        for date_format in ("%Y-%m-%d", "%m/%y", "%m/%Y", "%Y-%m", "%d.%m.%Y"):
+            # Быстрая проверка на одном значении перед полным проходом
+            try:
+                datetime.strptime(sample_value, date_format)
+            except ValueError:
+                continue
+            
+            failures = self.conn.execute(f"""
+                SELECT COUNT(*) FROM {source}
+                WHERE "{column}" IS NOT NULL AND TRY_STRPTIME("{column}", '{date_format}') IS NULL
+            """).fetchone()[0]
+            if failures == 0:
+                return date_format
+        return None
+    
+    def _table_size(self, table_name: str) -> Optional[int]:
+        """Примерный размер таблицы на диске (байты)"""
+        try:
+            self.conn.execute("CHECKPOINT")
+            block_size = self.conn.execute("PRAGMA database_size").fetchone()[2]
+            blocks = self.conn.execute(f"""
+                SELECT COUNT(DISTINCT block_id) FROM pragma_storage_info('{table_name}')
+                WHERE block_id >= 0
+            """).fetchone()[0]
+            return blocks * block_size if blocks else None
+        except Exception as e:
+            logger.debug("Could not measure table size: %s", e)
+            return None
+    
+    def compare_load_profiles(self, parquet_file: str = None, repeat: int = 3) -> Dict:
+        """
+        Загрузить parquet в raw и optimized профилях во временные таблицы
+        и сравнить размер и время GROUP BY по low-cardinality колонкам
+        """
+        parquet_file = parquet_file or settings.dataset_path
+        report = {}
+        tables = {"raw": "_load_profile_raw", "optimized": "_load_profile_optimized"}
+        
+        try:
+            for profile, table in tables.items():
+                start = time.time()
+                self._create_table(table, parquet_file, profile)
+                report[profile] = {
+                    "load_time": round(time.time() - start, 3),
+                    "size_bytes": self._table_size(table),
+                    "queries": {},
+                }
+            
+            # Колонки, ставшие ENUM, - основная нагрузка GROUP BY
+            enum_columns = [
+                row[0] for row in self.conn.execute(
+                    f"DESCRIBE {tables['optimized']}"
+                ).fetchall() if row[1].startswith("ENUM")
+            ]
+            for column in enum_columns:
+                for profile, table in tables.items():
+                    timings = []
+                    for _ in range(repeat):
+                        start = time.time()
+                        self.conn.execute(
+                            f'SELECT "{column}", COUNT(*) FROM {table} GROUP BY 1'
+                        ).fetchall()
+                        timings.append(time.time() - start)
+                    report[profile]["queries"][column] = round(min(timings), 4)
+            
+            for profile in tables:
+                report[profile]["total_query_time"] = round(sum(report[profile]["queries"].values()), 4)
+            
+            raw, optimized = report["raw"], report["optimized"]
+            if raw["size_bytes"] and optimized["size_bytes"]:
+                report["size_ratio"] = round(raw["size_bytes"] / optimized["size_bytes"], 2)
+            if optimized["total_query_time"]:
+                report["query_speedup"] = round(raw["total_query_time"] / optimized["total_query_time"], 2)
+            
+            logger.info(
+                f"📏 Load profiles: size x{report.get('size_ratio')}, "
+                f"GROUP BY speedup x{report.get('query_speedup')}"
+            )
+            return report
+        finally:
+            for table in tables.values():
+                self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+    
+    def _log_schema(self, catalog: Dict):
         """Вывести схему таблицы в лог"""
+        columns = list(catalog["columns"].items())
+        logger.info(f"📋 Table '{catalog['table']}' schema (catalog v{catalog['version']}):")
+        for name, info in columns[:10]:
+            logger.info(f"   {name:30s} {info['type']}")
+        if len(columns) > 10:
+            logger.info(f"   ... and {len(columns) - 10} more columns")
+    
+    def build_catalog(self, table_name: str = None) -> Dict:
+        """Посчитать статистику колонок и сохранить новую версию каталога"""
+        table_name = table_name or settings.table_name
+        catalog_table = settings.catalog_table
+        
+        # SUMMARIZE - типы, min/max, approx distinct и null% за один проход
+        summary = self.conn.execute(f"SUMMARIZE {table_name}").fetchall()
+        row_count = self.conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+        
+        version = self.conn.execute(
+            f"SELECT COALESCE(MAX(version), 0) + 1 FROM {catalog_table} WHERE table_name = ?",
+            [table_name]
+        ).fetchone()[0]
+        built_at = datetime.now()
+        
+        columns = {}
+        rows = []
+        for ordinal, col in enumerate(summary):
+            name, col_type, min_value, max_value, approx_distinct = col[:5]
+            null_fraction = float(col[11] or 0) / 100
+            if col_type.startswith("ENUM("):
+                col_type = "ENUM"  # значения - в top_values
+            
+            # Полный словарь значений (частые первыми) только для low-cardinality колонок
+            values = None
+            if approx_distinct <= settings.catalog_max_distinct:
+                values = [
+                    {"value": str(value), "count": count}
+                    for value, count in self.conn.execute(f"""
+                        SELECT "{name}", COUNT(*) AS cnt FROM {table_name}
+                        WHERE "{name}" IS NOT NULL
+                        GROUP BY 1 ORDER BY cnt DESC, 1
+                    """).fetchall()
+                ]
+            
+            columns[name] = self._catalog_column(
+                col_type, null_fraction, min_value, max_value, approx_distinct, values
+            )
+            # В колонке top_values хранится весь словарь, top-K выделяется при чтении
+            rows.append([
+                version, table_name, name, ordinal, col_type, row_count, null_fraction,
+                min_value, max_value, approx_distinct,
+                json.dumps(values, ensure_ascii=False) if values is not None else None,
+                built_at
+            ])
+        
+        try:
+            self.conn.execute(f"DELETE FROM {catalog_table} WHERE table_name = ?", [table_name])
+            self.conn.executemany(
+                f"INSERT INTO {catalog_table} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+        except Exception as e:
+            # read-only воркер: каталог остается только в памяти
+            logger.warning(f"⚠️ Could not persist catalog: {e}")
+        
+        self.catalog = {
+            "version": version,
+            "table": table_name,
+            "row_count": row_count,
+            "built_at": built_at.isoformat(),
+            "columns": columns,
+        }
+        logger.info(f"📚 Catalog v{version} built for '{table_name}' ({len(columns)} columns)")
+        return self.catalog
+    
+    def _load_catalog(self, table_name: str) -> Optional[Dict]:
+        """Прочитать сохраненный каталог из таблицы"""
+        rows = self.conn.execute(f"""
+            SELECT version, column_name, column_type, row_count, null_fraction,
+                   min_value, max_value, approx_distinct, top_values, built_at
+            FROM {settings.catalog_table}
+            WHERE table_name = ?
+            ORDER BY ordinal
+        """, [table_name]).fetchall()
+        if not rows:
+            return None
+        
+        return {
+            "version": rows[0][0],
+            "table": table_name,
+            "row_count": rows[0][3],
+            "built_at": rows[0][9].isoformat(),
+            "columns": {
+                row[1]: self._catalog_column(
+                    row[2], row[4], row[5], row[6], row[7], json.loads(row[8]) if row[8] else None
+                )
+                for row in rows
+            },
+        }
+    
+    def _catalog_column(self, col_type: str, null_fraction: float, min_value, max_value,
+                        approx_distinct: int, values: Optional[List[Dict]]) -> Dict:
+        """Запись каталога о колонке: values - весь словарь, top_values - первые top-K"""
+        return {
+            "type": col_type,
+            "null_fraction": round(null_fraction, 6),
+            "min": min_value,
+            "max": max_value,
+            "approx_distinct": approx_distinct,
+            "top_values": values[:settings.catalog_top_k] if values is not None else None,
+            "values": values,
+        }
+    
+    def get_catalog(self, table_name: str = None) -> Dict:
+        """Каталог из памяти; при первом обращении - из таблицы или построить"""
+        table_name = table_name or settings.table_name
+        if self.catalog and self.catalog["table"] == table_name:
+            return self.catalog
+        
         try:
-            columns = self.conn.execute(f"DESCRIBE {table_name}").fetchall()
-            logger.info(f"📋 Table '{table_name}' schema:")
-            for col in columns[:10]:
-                logger.info(f"   {col[0]:30s} {col[1]}")
-            if len(columns) > 10:
-                logger.info(f"   ... and {len(columns) - 10} more columns")
+            catalog = self._load_catalog(table_name)
         except Exception as e:
-            logger.warning(f"⚠️ Could not log schema: {e}")
+            logger.warning(f"⚠️ Could not read catalog: {e}")
+            catalog = None
+        
+        if catalog is None:
+            # Таблица загружена до появления каталога
+            catalog = self.build_catalog(table_name)
+        
+        self.catalog = catalog
+        return catalog
+    
+    def _sample_table(self, table_name: str, rate: float) -> str:
+        """Имя таблицы сэмпла (доля в базисных пунктах)"""
+        return f"{table_name}_sample_{round(rate * 10000)}bp"
+    
+    def _sample_info(self, sample_table: str, rate: float, row_count: int) -> Optional[Dict]:
+        """Описание сэмпла: размер и коэффициент масштабирования"""
+        rows = self._fetch_rows(f"SELECT COUNT(*) FROM {sample_table}", [])[0][0]
+        if not rows:
+            return None
+        return {"rate": rate, "table": sample_table, "rows": rows, "scale": row_count / rows}
+    
+    def build_samples(self, table_name: str = None, row_count: int = None) -> Dict[float, Dict]:
+        """Пересоздать равномерные (Bernoulli) сэмплы таблицы"""
+        table_name = table_name or settings.table_name
+        row_count = row_count or self.get_row_count(table_name)
+        samples = {}
+        
+        for rate in sorted(settings.sample_rates):
+            sample_table = self._sample_table(table_name, rate)
+            self.conn.execute(f"""
+                CREATE OR REPLACE TABLE {sample_table} AS
+                SELECT * FROM {table_name}
+                USING SAMPLE {rate * 100}% (bernoulli, 42)
+            """)
+            sample = self._sample_info(sample_table, rate, row_count)
+            if sample:
+                samples[rate] = sample
+                logger.info(f"🎲 Sample {rate:.1%}: {sample['rows']:,} rows in '{sample_table}'")
+        
+        self.samples = samples
+        return samples
+    
+    def get_samples(self, table_name: str = None) -> Dict[float, Dict]:
+        """Доступные сэмплы (найти уже созданные при первом обращении)"""
+        table_name = table_name or settings.table_name
+        if self.samples is not None:
+            return self.samples
+        
+        samples = {}
+        row_count = self.get_row_count(table_name)
+        existing = {
+            row[0] for row in self._fetch_rows("SELECT table_name FROM duckdb_tables()", [])
+        }
+        for rate in settings.sample_rates:
+            sample_table = self._sample_table(table_name, rate)
+            if sample_table not in existing:
+                continue
+            sample = self._sample_info(sample_table, rate, row_count)
+            if sample:
+                samples[rate] = sample
+        
+        self.samples = samples
+        return samples
     
-    def execute_sql(self, sql_query: str, timeout: int = None) -> List[Dict]:
+    def get_column_values(self, column: str, prefix: str = "", limit: int = 20) -> List[Dict]:
+        """Значения колонки для автодополнения (из словаря каталога в памяти, частые первыми)"""
+        catalog = self.get_catalog()
+        if column not in catalog["columns"]:
+            raise KeyError(column)
+        
+        values = catalog["columns"][column]["values"]
+        if values is None:
+            raise ValueError(f"Column '{column}' has no value dictionary (high cardinality)")
+        
+        prefix = prefix.lower()
+        return [v for v in values if v["value"].lower().startswith(prefix)][:limit]
+    
+    def get_transaction(self, transaction_id: str) -> Optional[Dict]:
+        """Одна транзакция по id (index scan, без admission control)"""
+        rows = self._fetch_dicts(
+            f"SELECT * FROM {settings.table_name} WHERE transaction_id = ?", [transaction_id]
+        )
+        return rows[0] if rows else None
+    
+    def get_merchant_summary(self, merchant_id: int) -> Optional[Dict]:
+        """Сводка по мерчанту: объем, период, разбивка по типу транзакции (index scan)"""
+        table = settings.table_name
+        summary = self._fetch_dicts(f"""
+            SELECT ANY_VALUE(merchant_id) AS merchant_id,
+                   ANY_VALUE(merchant_mcc) AS merchant_mcc,
+                   ANY_VALUE(mcc_category) AS mcc_category,
+                   ANY_VALUE(merchant_city) AS merchant_city,
+                   COUNT(*) AS transactions,
+                   COUNT(DISTINCT card_id) AS unique_cards,
+                   SUM(transaction_amount_kzt) AS total_amount_kzt,
+                   AVG(transaction_amount_kzt) AS avg_amount_kzt,
+                   MIN(transaction_timestamp) AS first_transaction,
+                   MAX(transaction_timestamp) AS last_transaction
+            FROM {table}
+            WHERE merchant_id = ?
+        """, [merchant_id])[0]
+        
+        if not summary["transactions"]:
+            return None
+        
+        summary["by_type"] = self._fetch_dicts(f"""
+            SELECT transaction_type,
+                   COUNT(*) AS transactions,
+                   SUM(transaction_amount_kzt) AS total_amount_kzt
+            FROM {table}
+            WHERE merchant_id = ?
+            GROUP BY 1
+            ORDER BY transactions DESC
+        """, [merchant_id])
+        return summary
+    
+    def query_columns(self, sql_query: str) -> List[str]:
+        """Названия колонок результата запроса (только bind, без выполнения)"""
+        return [row[0] for row in self._fetch_rows(f"DESCRIBE {sql_query}", [])]
+    
+    def execute_sql(self, sql_query: str, timeout: int = None) -> ResultSet:
         """Выполнить SQL запрос"""
+        results, _ = self._execute(sql_query, timeout)
+        return results
+    
+    def execute_sql_profiled(self, sql_query: str, timeout: int = None) -> Tuple[ResultSet, Dict]:
+        """Выполнить SQL запрос с JSON профилированием DuckDB"""
+        return self._execute(sql_query, timeout, profile=True)
+    
+    def _execute(self, sql_query: str, timeout: int = None,
+                 profile: bool = False) -> Tuple[ResultSet, Optional[Dict]]:
+        """Выполнить SQL запрос, при profile=True вернуть профиль операторов"""
         timeout = timeout or settings.query_timeout
+        profile_info = None
         
         try:
             # Установить таймаут
             #self.conn.execute(f"SET query_timeout = '{timeout}s'")
             
-            # Выполнить запрос
-            result = self.conn.execute(sql_query)
-            rows = result.fetchall()
+            # Admission control: тяжелые запросы ждут, а не перегружают память
+            weight = estimate_query_weight(sql_query)
+            if not self.admission.acquire(weight, settings.admission_timeout):
+                raise Exception(
+                    f"Database is busy, query was queued longer than {settings.admission_timeout}s"
+                )
+            
+            # Выполнить запрос (отдельный cursor - вызывается из threadpool)
+            try:
+                if profile:
+                    # Профилированный запрос тоже учитывается в статистике шаблона
+                    stats, _ = self._start_fingerprint(sql_query)
+                    start = time.time()
+                    fd, profile_path = tempfile.mkstemp(suffix=".json", prefix="duckdb_profile_")
+                    os.close(fd)
+                    try:
+                        with self.conn.cursor() as cursor:
+                            cursor.execute("SET enable_profiling = 'json'")
+                            cursor.execute(f"SET profiling_output = '{profile_path}'")
+                            
+                            result = cursor.execute(sql_query)
+                            rows = result.fetchall()
+                            description = result.description or []
+                            
+                            cursor.execute("SET enable_profiling = 'no_output'")
+                        profile_info = self._read_profile(profile_path)
+                    finally:
+                        # Файл профиля удаляется и при ошибке запроса
+                        if os.path.exists(profile_path):
+                            os.remove(profile_path)
+                    self._finish_fingerprint(stats, time.time() - start, "profiled")
+                else:
+                    rows, description = self._execute_cached(sql_query)
+            finally:
+                self.admission.release(weight)
             
-            # Получить названия столбцов
-            columns = [desc[0] for desc in result.description] if result.description else []
+            # Получить названия и типы столбцов
+            columns = [desc[0] for desc in description]
+            types = [str(desc[1]) for desc in description]
+            types = ["ENUM" if t.startswith("ENUM(") else t for t in types]
+            
+            # Ограничить количество результатов (до конвертации)
+            if len(rows) > settings.max_results:
+                logger.warning(f"⚠️ Results limited to {settings.max_results} rows")
+                rows = rows[:settings.max_results]
             
             # Конвертировать в список словарей
-            results = []
+            convert_start = time.time()
+            results = ResultSet(columns, types)
             for row in rows:
                 row_dict = {}
                 for i, col_name in enumerate(columns):
@@ -137,24 +717,166 @@ class Database:
                 
                 results.append(row_dict)
             
-            # Ограничить количество результатов
-            if len(results) > settings.max_results:
-                logger.warning(f"⚠️ Results limited to {settings.max_results} rows")
-                results = results[:settings.max_results]
+            if profile:
+                profile_info["conversion_time"] = time.time() - convert_start
             
-            logger.debug(f"💾 Query returned {len(results)} rows")
-            return results
+            logger.debug("💾 Query returned %d rows", len(results))
+            return results, profile_info
             
         except Exception as e:
             logger.error(f"❌ SQL execution failed: {e}")
             raise Exception(f"Database error: {str(e)}")
     
+    def _thread_cursor(self):
+        """Cursor текущего потока и его prepared statements (живут между запросами)"""
+        local = self._local
+        if getattr(local, "conn", None) is not self.conn:
+            local.conn = self.conn
+            local.cursor = self.conn.cursor()
+            local.prepared = OrderedDict()
+        return local.cursor, local.prepared
+    
+    def _execute_cached(self, sql_query: str) -> Tuple[list, list]:
+        """
+        Выполнить запрос; частые шаблоны - через закешированный prepared statement
+        
+        Returns:
+            (строки, description)
+        """
+        template, params = parameterize_sql(sql_query)
+        cursor, prepared = self._thread_cursor()
+        
+        stats, count = self._start_fingerprint(sql_query)
+        use_prepared = settings.prepared_statements and params and count >= settings.prepared_min_count
+        
+        start = time.time()
+        result = None
+        # None в кеше - шаблон уже не удалось подготовить
+        if use_prepared and not (template in prepared and prepared[template] is None):
+            try:
+                name = prepared.get(template)
+                if name is None:
+                    name = "plan_" + hashlib.sha1(template.encode("utf-8")).hexdigest()[:16]
+                    cursor.execute(f"PREPARE {name} AS {template}")
+                    prepared[template] = name
+                    # LRU: выбросить самый старый план
+                    while len(prepared) > settings.prepared_cache_size:
+                        _, old_name = prepared.popitem(last=False)
+                        if old_name:
+                            cursor.execute(f"DEALLOCATE {old_name}")
+                else:
+                    prepared.move_to_end(template)
+                
+                result = cursor.execute(f"EXECUTE {name}({', '.join(params)})")
+            except duckdb.Error as e:
+                # Шаблон не готовится (например, неизвестный тип параметра) - больше не пробовать
+                logger.debug("Prepared statement fallback for %s: %s", stats["fingerprint"], e)
+                prepared[template] = None
+                result = None
+        
+        prepared_hit = result is not None
+        if result is None:
+            result = cursor.execute(sql_query)
+        rows = result.fetchall()
+        
+        if prepared_hit:
+            counter = "prepared_hits"
+        else:
+            counter = "fallbacks" if use_prepared else None
+        self._finish_fingerprint(stats, time.time() - start, counter)
+        return rows, result.description or []
+    
+    def _start_fingerprint(self, sql_query: str) -> Tuple[Dict, int]:
+        """Статистика шаблона запроса (создать при первом выполнении) и номер выполнения"""
+        fingerprint = sql_fingerprint(sql_query)
+        with self._fingerprint_lock:
+            stats = self.fingerprints.get(fingerprint)
+            if stats is not None:
+                self.fingerprints.move_to_end(fingerprint)
+            else:
+                stats = self.fingerprints[fingerprint] = {
+                    "fingerprint": fingerprint,
+                    "pattern": sql_pattern(sql_query),
+                    "count": 0,
+                    "total_time": 0.0,
+                    "last_time": None,
+                    "prepared_hits": 0,
+                    "fallbacks": 0,
+                    "profiled": 0,
+                }
+                # Редкие шаблоны вытесняются, чтобы словарь не рос с каждым новым запросом
+                while len(self.fingerprints) > settings.fingerprint_cache_size:
+                    self.fingerprints.popitem(last=False)
+            stats["count"] += 1
+            return stats, stats["count"]
+    
+    def _finish_fingerprint(self, stats: Dict, elapsed: float, counter: str = None):
+        with self._fingerprint_lock:
+            stats["total_time"] += elapsed
+            stats["last_time"] = elapsed
+            if counter:
+                stats[counter] += 1
+    
+    def should_profile(self, sql_query: str) -> bool:
+        """Авто-профилирование: прошлое выполнение этого шаблона было дольше PROFILE_SLOW_THRESHOLD"""
+        threshold = settings.profile_slow_threshold
+        if threshold <= 0:
+            return False
+        with self._fingerprint_lock:
+            stats = self.fingerprints.get(sql_fingerprint(sql_query))
+            return bool(stats and stats["last_time"] is not None and stats["last_time"] >= threshold)
+    
+    def get_fingerprint_stats(self, limit: int = 50) -> List[Dict]:
+        """Статистика по шаблонам запросов: число выполнений, средняя латентность, prepared hits"""
+        with self._fingerprint_lock:
+            stats = [dict(s) for s in self.fingerprints.values()]
+        
+        for s in stats:
+            s["mean_latency"] = round(s["total_time"] / s["count"], 4) if s["count"] else 0.0
+            s["total_time"] = round(s["total_time"], 4)
+            s["last_time"] = round(s["last_time"], 4) if s["last_time"] is not None else None
+        stats.sort(key=lambda s: s["count"], reverse=True)
+        return stats[:limit]
+    
+    def _read_profile(self, profile_path: str) -> Dict:
+        """Прочитать JSON профиль DuckDB и удалить файл"""
+        try:
+            with open(profile_path, encoding="utf-8") as f:
+                tree = json.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read query profile: {e}")
+            tree = {}
+        finally:
+            if os.path.exists(profile_path):
+                os.remove(profile_path)
+        
+        # Операторы по собственному времени (ключи различаются между версиями DuckDB)
+        operators = []
+        def walk(node):
+            for child in node.get("children", []):
+                name = child.get("operator_type") or child.get("operator_name") or child.get("name")
+                timing = child.get("operator_timing", child.get("timing", 0)) or 0
+                operators.append({"operator": name, "time": timing})
+                walk(child)
+        walk(tree)
+        
+        total = sum(op["time"] for op in operators) or 1
+        dominant = sorted(operators, key=lambda op: op["time"], reverse=True)[:3]
+        for op in dominant:
+            op["share"] = round(op["time"] / total, 3)
+        
+        return {
+            "latency": tree.get("latency", tree.get("timing")),
+            "dominant_operators": dominant,
+            "tree": tree,
+        }
+    
     def get_schema(self, table_name: str = None) -> Dict[str, str]:
         """Получить схему таблицы"""
         table_name = table_name or settings.table_name
         try:
-            columns = self.conn.execute(f"DESCRIBE {table_name}").fetchall()
-            return {col[0]: col[1] for col in columns}
+            catalog = self.get_catalog(table_name)
+            return {name: info["type"] for name, info in catalog["columns"].items()}
         except Exception as e:
             logger.error(f"❌ Failed to get schema: {e}")
             raise
@@ -163,36 +885,215 @@ class Database:
         """Получить количество строк"""
         table_name = table_name or settings.table_name
         try:
-            count = self.conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+            count = self._fetch_rows(f"SELECT COUNT(*) FROM {table_name}", [])[0][0]
             return count
         except Exception as e:
             logger.error(f"❌ Failed to get row count: {e}")
             return 0
     
     def log_query(self, user_query: str, sql: str, success: bool, 
-               error: str = None, execution_time: float = 0, rows: int = 0):
-        """Сохранить запрос в лог-таблицу"""
+               error: str = None, execution_time: float = 0, rows: int = 0) -> Optional[int]:
+        """Сохранить запрос в лог-таблицу, вернуть id записи"""
         try:
-            self.conn.execute("""
+            return self._fetch_rows("""
                 INSERT INTO query_logs 
-                (user_query, generated_sql, success, error_message, execution_time, rows_returned)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, [user_query, sql, success, error, execution_time, rows])
+                (user_query, generated_sql, success, error_message, execution_time, rows_returned,
+                 sql_pattern, sql_fingerprint)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                RETURNING id
+            """, [user_query, sql, success, error, execution_time, rows,
+                  sql_pattern(sql) if sql else None,
+                  sql_fingerprint(sql) if sql else None])[0][0]
         except Exception as e:
             logger.warning(f"⚠️ Failed to log query: {e}")
+            return None
     
-    def get_logs(self, limit: int = 50) -> List[Dict]:
-        """Получить последние логи"""
+    def save_profile(self, log_id: int, sql: str, db_time: float, profile: Dict):
+        """Сохранить профиль DuckDB рядом с записью query_logs"""
+        dominant = profile["dominant_operators"]
         try:
-            logs = self.execute_sql(f"""
+            self._fetch_rows("""
+                INSERT OR REPLACE INTO query_profiles
+                (log_id, sql_pattern, db_time, conversion_time, dominant_operator, dominant_operators, profile)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [log_id, sql_pattern(sql), db_time, profile["conversion_time"],
+                  dominant[0]["operator"] if dominant else None,
+                  json.dumps(dominant), json.dumps(profile["tree"])])
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to save query profile: {e}")
+    
+    def get_profile(self, log_id: int) -> Optional[Dict]:
+        """Профиль запроса по id лога"""
+        rows = self._fetch_rows("""
+            SELECT p.log_id, p.timestamp, l.generated_sql, p.sql_pattern, p.db_time,
+                   p.conversion_time, p.dominant_operators, p.profile
+            FROM query_profiles p
+            JOIN query_logs l ON l.id = p.log_id
+            WHERE p.log_id = ?
+        """, [log_id])
+        if not rows:
+            return None
+        
+        row = rows[0]
+        return {
+            "log_id": row[0],
+            "timestamp": row[1].isoformat(),
+            "sql": row[2],
+            "sql_pattern": row[3],
+            "db_time": row[4],
+            "conversion_time": row[5],
+            "dominant_operators": json.loads(row[6]),
+            "profile": json.loads(row[7]),
+        }
+    
+    def get_slow_queries(self, limit: int = 20) -> List[Dict]:
+        """Шаблоны SQL из профилей, по суммарному времени в DuckDB"""
+        return self._fetch_dicts("""
+            WITH frequency AS (
+                SELECT sql_pattern, COUNT(*) AS executions
+                FROM query_logs
+                WHERE success
+                GROUP BY sql_pattern
+            )
+            SELECT p.sql_pattern,
+                   f.executions,
+                   COUNT(*) AS profiled,
+                   SUM(p.db_time) AS total_db_time,
+                   AVG(p.db_time) AS avg_db_time,
+                   MAX(p.db_time) AS max_db_time,
+                   AVG(p.conversion_time) AS avg_conversion_time,
+                   MODE(p.dominant_operator) AS dominant_operator,
+                   ARG_MAX(p.log_id, p.db_time) AS slowest_log_id
+            FROM query_profiles p
+            LEFT JOIN frequency f ON f.sql_pattern = p.sql_pattern
+            GROUP BY p.sql_pattern, f.executions
+            ORDER BY total_db_time DESC
+            LIMIT ?
+        """, [limit])
+    
+    def _log_filters(self, since: datetime = None, until: datetime = None,
+                     success: bool = None, error_contains: str = None,
+                     min_execution_time: float = None,
+                     fingerprint: str = None) -> Tuple[str, list]:
+        """WHERE для query_logs с параметрами"""
+        conditions = []
+        params = []
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("timestamp < ?")
+            params.append(until)
+        if success is not None:
+            conditions.append("success = ?")
+            params.append(success)
+        if error_contains:
+            conditions.append("error_message ILIKE ?")
+            params.append(f"%{error_contains}%")
+        if min_execution_time is not None:
+            conditions.append("execution_time >= ?")
+            params.append(min_execution_time)
+        if fingerprint:
+            conditions.append("sql_fingerprint = ?")
+            params.append(fingerprint)
+        
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return where, params
+    
+    def _fetch_rows(self, sql: str, params: list) -> List[tuple]:
+        """Выполнить служебный запрос в отдельном cursor"""
+        with self.conn.cursor() as cursor:
+            return cursor.execute(sql, params).fetchall()
+    
+    def _fetch_dicts(self, sql: str, params: list) -> List[Dict]:
+        """Выполнить служебный запрос и вернуть строки как словари (без конвертации типов)"""
+        with self.conn.cursor() as cursor:
+            result = cursor.execute(sql, params)
+            columns = [desc[0] for desc in result.description]
+            return [dict(zip(columns, row)) for row in result.fetchall()]
+    
+    def get_logs(self, limit: int = 50, offset: int = 0, **filters) -> Dict:
+        """Получить логи с фильтрами и пагинацией (новые сверху)"""
+        try:
+            where, params = self._log_filters(**filters)
+            logs = self._fetch_dicts(f"""
                 SELECT * FROM query_logs 
-                ORDER BY timestamp DESC 
-                LIMIT {limit}
-            """)
-            return logs
+                {where}
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ? OFFSET ?
+            """, params + [limit, offset])
+            total = self._fetch_dicts(
+                f"SELECT COUNT(*) AS total FROM query_logs {where}", params
+            )[0]["total"]
+            return {"total": total, "logs": logs}
         except Exception as e:
             logger.warning(f"⚠️ Failed to get logs: {e}")
-            return []
+            return {"total": 0, "logs": []}
+    
+    def get_log_stats(self, since: datetime = None, until: datetime = None,
+                      top: int = 10) -> Dict:
+        """Агрегаты по логам за окно: латентность, доля ошибок, топ вопросов и ошибочных SQL"""
+        where, params = self._log_filters(since=since, until=until)
+        
+        summary = self._fetch_dicts(f"""
+            SELECT COUNT(*) AS total,
+                   COUNT(*) FILTER (WHERE NOT success) AS failed,
+                   COALESCE(AVG(CASE WHEN success THEN 0.0 ELSE 1.0 END), 0) AS failure_rate,
+                   QUANTILE_CONT(execution_time, 0.5) FILTER (WHERE success) AS p50_latency,
+                   QUANTILE_CONT(execution_time, 0.95) FILTER (WHERE success) AS p95_latency,
+                   MAX(execution_time) FILTER (WHERE success) AS max_latency
+            FROM query_logs {where}
+        """, params)[0]
+        
+        top_questions = self._fetch_dicts(f"""
+            SELECT LOWER(TRIM(user_query)) AS question,
+                   COUNT(*) AS count,
+                   AVG(execution_time) FILTER (WHERE success) AS avg_latency
+            FROM query_logs {where}
+            GROUP BY 1
+            ORDER BY count DESC, question
+            LIMIT ?
+        """, params + [top])
+        
+        failing_where = f"{where} AND NOT success" if where else "WHERE NOT success"
+        top_failing_sql = self._fetch_dicts(f"""
+            SELECT generated_sql AS sql,
+                   COUNT(*) AS count,
+                   ARG_MAX(error_message, timestamp) AS last_error
+            FROM query_logs {failing_where}
+            GROUP BY 1
+            ORDER BY count DESC, sql
+            LIMIT ?
+        """, params + [top])
+        
+        return {
+            **summary,
+            "top_questions": top_questions,
+            "top_failing_sql": top_failing_sql,
+        }
+    
+    def get_resource_usage(self) -> Dict:
+        """Текущее потребление памяти DuckDB, лимиты и очередь admission control"""
+        with self.conn.cursor() as cursor:
+            memory_limit, threads, temp_directory = cursor.execute("""
+                SELECT current_setting('memory_limit'),
+                       current_setting('threads'),
+                       current_setting('temp_directory')
+            """).fetchone()
+            memory_bytes, temp_bytes = cursor.execute("""
+                SELECT COALESCE(SUM(memory_usage_bytes), 0),
+                       COALESCE(SUM(temporary_storage_bytes), 0)
+                FROM duckdb_memory()
+            """).fetchone()
+        
+        return {
+            "memory_usage_bytes": int(memory_bytes),
+            "temporary_storage_bytes": int(temp_bytes),
+            "memory_limit": memory_limit,
+            "threads": int(threads),
+            "temp_directory": temp_directory,
+            "admission": self.admission.stats(),
+        }
     
     def close(self):
         """Закрыть соединение"""
@@ -1,51 +1,117 @@
 """
 Настройка логирования
+
+Запись в файл и консоль идет в отдельном потоке (QueueHandler + QueueListener),
+поток запроса только кладет запись в очередь.
 """
+import atexit
+import contextvars
+import json
 import logging
+import logging.handlers
 import os
+import queue
 from datetime import datetime
 from config import settings
 
 # Создать папку для логов
-os.makedirs("logs", exist_ok=True)
+os.makedirs(os.path.dirname(settings.log_file) or ".", exist_ok=True)
 
 # Формат логов
 log_format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 date_format = "%Y-%m-%d %H:%M:%S"
 
+# ID текущего HTTP запроса (выставляется middleware в main.py)
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+class RequestIdFilter(logging.Filter):
+    """Добавить request_id в каждую запись"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """Структурированный JSON лог: одна запись - одна строка"""
+
+    # Поля из extra=..., которые попадают в JSON
+    extra_fields = ("stage_timings", "rows", "sql_pattern", "log_id", "fingerprint")
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        for field in self.extra_fields:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def _formatter() -> logging.Formatter:
+    if settings.log_format.lower() == "json":
+        return JsonFormatter()
+    return logging.Formatter(log_format, date_format)
+
+def _file_handler() -> logging.Handler:
+    """Файловый handler с ротацией по размеру или по времени"""
+    if settings.log_rotation.lower() == "time":
+        return logging.handlers.TimedRotatingFileHandler(
+            settings.log_file, when=settings.log_rotation_when,
+            backupCount=settings.log_backup_count, encoding='utf-8'
+        )
+    return logging.handlers.RotatingFileHandler(
+        settings.log_file, maxBytes=settings.log_max_bytes,
+        backupCount=settings.log_backup_count, encoding='utf-8'
+    )
+
 # Создать logger
 logger = logging.getLogger("mastercard_backend")
 logger.setLevel(getattr(logging, settings.log_level.upper()))
 
 # Handler для файла
-file_handler = logging.FileHandler(settings.log_file, encoding='utf-8')
+file_handler = _file_handler()
 file_handler.setLevel(logging.INFO)
-file_handler.setFormatter(logging.Formatter(log_format, date_format))
+file_handler.setFormatter(_formatter())
 
 # Handler для консоли
 console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.DEBUG if settings.debug else logging.INFO)
-console_handler.setFormatter(logging.Formatter(log_format, date_format))
+console_handler.setFormatter(_formatter())
+
+# Очередь: I/O в потоке listener, а не в потоке запроса
+log_queue = queue.SimpleQueue()
+queue_handler = logging.handlers.QueueHandler(log_queue)
+queue_handler.addFilter(RequestIdFilter())
+listener = logging.handlers.QueueListener(
+    log_queue, file_handler, console_handler, respect_handler_level=True
+)
 
 # Добавить handlers
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+logger.addHandler(queue_handler)
+logger.propagate = False
+listener.start()
+atexit.register(listener.stop)
 
 # Функции для удобного логирования
 def log_query(user_query: str, sql: str, success: bool, error: str = None):
     """Логировать запрос пользователя"""
     if success:
-        logger.info(f"✅ Query: '{user_query}' | SQL: '{sql[:100]}...'")
+        logger.info("✅ Query: '%s' | SQL: '%.100s...'", user_query, sql)
     else:
-        logger.error(f"❌ Query: '{user_query}' | Error: {error}")
+        logger.error("❌ Query: '%s' | Error: %s", user_query, error)
 
 def log_nlp_call(query: str, response_time: float, success: bool):
     """Логировать вызов NLP модели"""
     if success:
-        logger.info(f"🤖 NLP call successful | Query: '{query}' | Time: {response_time:.2f}s")
+        logger.info("🤖 NLP call successful | Query: '%s' | Time: %.2fs", query, response_time)
     else:
-        logger.error(f"🤖 NLP call failed | Query: '{query}'")
+        logger.error("🤖 NLP call failed | Query: '%s'", query)
 
 def log_db_query(sql: str, rows: int, execution_time: float):
     """Логировать выполнение SQL"""
-    logger.info(f"💾 DB query | Rows: {rows} | Time: {execution_time:.3f}s | SQL: '{sql[:100]}...'")
\ No newline at end of file
+    logger.info("💾 DB query | Rows: %d | Time: %.3fs | SQL: '%.100s...'", rows, execution_time, sql)
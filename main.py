@@ -1,20 +1,28 @@
 """
 FastAPI Backend для Mastercard Analytics
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from datetime import datetime, timedelta
+from typing import Optional
 import time
+import uuid
 
 from config import settings
-from logger import logger
+from logger import logger, request_id_var
 from models import (
     QueryRequest, QueryResponse, HealthResponse,
-    ExamplesResponse, SchemaResponse
+    ExamplesResponse, SchemaResponse, ColumnValuesResponse
 )
 from database import db
 from nlp_client import nlp_client
-from validators import validate_sql_security, validate_sql_structure, sanitize_sql
+from validators import validate_sql_security, validate_sql_structure, sanitize_sql, sql_fingerprint
+from coalescing import nlp_flight, sql_flight, normalize_question
+from approximate import pick_sample, execute_approximate
+from responses import CompactJSONResponse, dumps, format_results
 
 # ============================================
 # СОЗДАНИЕ ПРИЛОЖЕНИЯ
@@ -37,6 +45,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Сжатие больших ответов (Accept-Encoding: gzip)
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=settings.gzip_min_size,
+    compresslevel=settings.gzip_level
+)
+
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    """Проставить request id в логи и заголовок ответа"""
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:12]
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 # ============================================
 # STARTUP / SHUTDOWN
 # ============================================
@@ -106,6 +133,62 @@ def health_check():
         version=settings.app_version
     )
 
+def _build_response(sql: str, results: list, start_time: float, sample: dict = None,
+                    margins: list = None, result_format: str = "records") -> dict:
+    """Собрать успешный ответ (точный или по сэмплу) в виде dict для CompactJSONResponse"""
+    return {
+        "success": True,
+        "sql": sql,
+        **format_results(results, result_format),
+        "count": len(results),
+        "execution_time": round(time.time() - start_time, 3),
+        "error": None,
+        "format": result_format,
+        "approximate": sample is not None,
+        "sample_rate": sample["rate"] if sample else None,
+        "error_margins": (margins or None) if sample else None,
+        "log_id": None
+    }
+
+def _progressive_stream(user_query: str, sql: str, start_time: float, rate: float = None,
+                        result_format: str = "records"):
+    """NDJSON: оценки по сэмплам возрастающего размера, последней строкой - точный ответ"""
+    samples = db.get_samples()
+    first = pick_sample(rate)
+    for sample_rate in sorted(samples):
+        if not first or sample_rate < first["rate"]:
+            continue
+        try:
+            results, margins = execute_approximate(sql, samples[sample_rate])
+        except ValueError:
+            break  # Запрос без агрегатов - сразу точный ответ
+        except Exception as e:
+            logger.warning(f"⚠️ Approximate execution failed: {e}")
+            break
+        yield dumps(_build_response(
+            sql, results, start_time, samples[sample_rate], margins, result_format
+        )) + "\n"
+    
+    try:
+        results = db.execute_sql(sql)
+    except Exception as e:
+        logger.error(f"❌ Database execution failed: {e}")
+        db.log_query(user_query, sql, False, str(e), 0, 0)
+        yield QueryResponse(
+            success=False, sql=sql, count=0,
+            execution_time=round(time.time() - start_time, 3),
+            error=f"Database error: {str(e)}"
+        ).model_dump_json() + "\n"
+        return
+    
+    response = _build_response(sql, results, start_time, result_format=result_format)
+    response["log_id"] = db.log_query(
+        user_query, sql, True, None, response["execution_time"], response["count"]
+    )
+    logger.info("✅ Progressive query completed in %.2fs", response["execution_time"],
+                extra={"rows": response["count"]})
+    yield dumps(response) + "\n"
+
 @app.post("/ask", response_model=QueryResponse, tags=["Analytics"])
 async def ask_question(request: QueryRequest):
     """
@@ -114,16 +197,18 @@ async def ask_question(request: QueryRequest):
     start_time = time.time()
     user_query = request.query
     
-    logger.info(f"📝 New query: '{user_query}'")
+    logger.info("📝 New query: '%s'", user_query)
     
     try:
         # ШАГ 1: Генерация SQL через NLP модель
         try:
             nlp_start = time.time()
-            sql = nlp_client.generate_sql(user_query)
+            sql = await nlp_flight.do(
+                normalize_question(user_query), nlp_client.generate_sql, user_query
+            )
             nlp_time = time.time() - nlp_start
             
-            logger.info(f"🤖 NLP generated SQL in {nlp_time:.2f}s")
+            logger.debug("🤖 NLP generated SQL in %.2fs", nlp_time)
             
         except Exception as e:
             logger.error(f"❌ NLP generation failed: {e}")
@@ -134,37 +219,65 @@ async def ask_question(request: QueryRequest):
         
         # ШАГ 2: Санитизация SQL
         sql = sanitize_sql(sql)
-        logger.debug(f"🧹 Sanitized SQL: {sql}")
+        logger.debug("🧹 Sanitized SQL: %s", sql)
         
         # ШАГ 3: Валидация безопасности
         is_valid, error_msg = validate_sql_security(sql)
         if not is_valid:
-            logger.warning(f"⚠️ SQL validation failed: {error_msg}")
-            db.log_query(user_query, sql, False, error_msg, 0, 0)
+            logger.warning("⚠️ SQL validation failed: %s", error_msg)
+            await run_in_threadpool(db.log_query, user_query, sql, False, error_msg, 0, 0)
             raise HTTPException(status_code=400, detail=error_msg)
         
         # ШАГ 4: Валидация структуры
         is_valid, error_msg = validate_sql_structure(sql)
         if not is_valid:
-            logger.warning(f"⚠️ SQL structure invalid: {error_msg}")
-            db.log_query(user_query, sql, False, error_msg, 0, 0)
+            logger.warning("⚠️ SQL structure invalid: %s", error_msg)
+            await run_in_threadpool(db.log_query, user_query, sql, False, error_msg, 0, 0)
             raise HTTPException(status_code=400, detail=error_msg)
         
-        # ШАГ 5: Выполнение SQL на БД
+        # ШАГ 5: Выполнение SQL на БД (точно или по сэмплу)
+        if request.approximate and request.progressive:
+            return StreamingResponse(
+                _progressive_stream(user_query, sql, start_time, request.sample_rate, request.format),
+                media_type="application/x-ndjson"
+            )
+        
+        sample = None
+        if request.approximate:
+            sample = await run_in_threadpool(pick_sample, request.sample_rate)
+        margins = None
+        profile = None
+        # Авто-профиль - только для повторов шаблона, который уже был медленным
+        profiling = request.profile or db.should_profile(sql)
         try:
             db_start = time.time()
-            results = db.execute_sql(sql)
+            if sample:
+                try:
+                    results, margins = await sql_flight.do(
+                        f"{sample['table']}:{sql}", execute_approximate, sql, sample
+                    )
+                except ValueError:
+                    # Запрос без COUNT/SUM (или с DISTINCT / подзапросом) - оценивать нечего
+                    sample = None
+                except Exception as e:
+                    # SQL для сэмпла не выполнился - ответить точно
+                    logger.warning(f"⚠️ Approximate execution failed, running exact: {e}")
+                    sample = None
+            if not sample and profiling:
+                results, profile = await sql_flight.do(
+                    f"profile:{sql}", db.execute_sql_profiled, sql
+                )
+            elif not sample:
+                results = await sql_flight.do(sql, db.execute_sql, sql)
             db_time = time.time() - db_start
             
-            # Получить названия столбцов
-            columns = list(results[0].keys()) if results else []
             count = len(results)
             
-            logger.info(f"💾 Query executed in {db_time:.2f}s, returned {count} rows")
+            logger.debug("💾 Query executed in %.2fs, returned %d rows", db_time, count)
             
         except Exception as e:
             logger.error(f"❌ Database execution failed: {e}")
-            db.log_query(user_query, sql, False, str(e), 0, 0)
+            await run_in_threadpool(db.log_query, user_query, sql, False, str(e), 0, 0)
             raise HTTPException(
                 status_code=500,
                 detail=f"Database error: {str(e)}"
@@ -172,19 +285,28 @@ async def ask_question(request: QueryRequest):
         
         # ШАГ 6: Логирование и возврат результата
         total_time = time.time() - start_time
-        db.log_query(user_query, sql, True, None, total_time, count)
+        log_id = await run_in_threadpool(db.log_query, user_query, sql, True, None, total_time, count)
         
-        logger.info(f"✅ Query completed in {total_time:.2f}s")
+        # Профиль: по запросу или если запрос медленнее порога
+        if profile and log_id and (request.profile or db_time >= settings.profile_slow_threshold):
+            await run_in_threadpool(db.save_profile, log_id, sql, db_time, profile)
+            logger.info("🔬 Query profile saved for log #%s", log_id)
         
-        return QueryResponse(
-            success=True,
-            sql=sql,
-            results=results,
-            columns=columns,
-            count=count,
-            execution_time=round(total_time, 3),
-            error=None
-        )
+        logger.info("✅ Query completed in %.2fs", total_time, extra={
+            "stage_timings": {
+                "nlp": round(nlp_time, 3),
+                "db": round(db_time, 3),
+                "total": round(total_time, 3)
+            },
+            "rows": count,
+            "log_id": log_id,
+            "fingerprint": sql_fingerprint(sql)
+        })
+        
+        # Готовый JSON: без повторной валидации results через QueryResponse
+        response = _build_response(sql, results, start_time, sample, margins, request.format)
+        response["log_id"] = log_id
+        return CompactJSONResponse(response)
         
     except HTTPException:
         raise
@@ -212,29 +334,161 @@ def get_examples():
 def get_schema():
     """Получить схему таблицы"""
     try:
-        schema = db.get_schema()
-        total_rows = db.get_row_count()
+        catalog = db.get_catalog()
         
         return SchemaResponse(
             table=settings.table_name,
-            columns=schema,
-            total_rows=total_rows
+            columns={name: info["type"] for name, info in catalog["columns"].items()},
+            total_rows=catalog["row_count"],
+            catalog_version=catalog["version"],
+            built_at=catalog["built_at"],
+            column_stats=catalog["columns"]
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/columns/{name}/values", response_model=ColumnValuesResponse, tags=["Schema"])
+def get_column_values(name: str, prefix: str = "", limit: int = Query(20, ge=1, le=100)):
+    """Частые значения колонки для автодополнения"""
+    try:
+        values = db.get_column_values(name, prefix=prefix, limit=limit)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Column '{name}' not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return ColumnValuesResponse(column=name, prefix=prefix, values=values)
+
+@app.get("/transactions/{transaction_id}", tags=["Drill-down"])
+def get_transaction(transaction_id: str):
+    """Транзакция по id напрямую из DuckDB (без NLP модели)"""
+    start_time = time.time()
+    try:
+        transaction = db.get_transaction(transaction_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if transaction is None:
+        raise HTTPException(status_code=404, detail=f"Transaction '{transaction_id}' not found")
+    return CompactJSONResponse({
+        "transaction": transaction,
+        "execution_time": round(time.time() - start_time, 3)
+    })
+
+@app.get("/merchants/{merchant_id}/summary", tags=["Drill-down"])
+def get_merchant_summary(merchant_id: int):
+    """Сводка по мерчанту напрямую из DuckDB (без NLP модели)"""
+    start_time = time.time()
+    try:
+        summary = db.get_merchant_summary(merchant_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if summary is None:
+        raise HTTPException(status_code=404, detail=f"Merchant {merchant_id} not found")
+    return CompactJSONResponse({
+        "summary": summary,
+        "execution_time": round(time.time() - start_time, 3)
+    })
+
 @app.get("/logs", tags=["Logs"])
-def get_logs(limit: int = 50):
-    """Получить последние логи запросов (для audit)"""
+def get_logs(
+    limit: int = Query(50, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    success: Optional[bool] = None,
+    error: Optional[str] = Query(None, description="Substring of error message"),
+    min_latency: Optional[float] = Query(None, ge=0, description="Minimum execution time, seconds"),
+    fingerprint: Optional[str] = Query(None, description="SQL template fingerprint (see /fingerprints)")
+):
+    """Получить логи запросов с фильтрами и пагинацией (для audit)"""
     try:
-        logs = db.get_logs(limit=limit)
+        page = db.get_logs(
+            limit=limit, offset=offset, since=since, until=until, success=success,
+            error_contains=error, min_execution_time=min_latency, fingerprint=fingerprint
+        )
         return {
-            "count": len(logs),
-            "logs": logs
+            "count": len(page["logs"]),
+            "total": page["total"],
+            "offset": offset,
+            "logs": page["logs"]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/logs/stats", tags=["Logs"])
+def get_log_stats(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    hours: float = Query(24, gt=0, description="Window size if 'since' is not set"),
+    top: int = Query(10, ge=1, le=100)
+):
+    """Агрегаты по логам за окно: p50/p95 латентности, доля ошибок, топ вопросов и ошибочных SQL"""
+    since = since or datetime.now() - timedelta(hours=hours)
+    try:
+        stats = db.get_log_stats(since=since, until=until, top=top)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return {
+        "since": since.isoformat(),
+        "until": until.isoformat() if until else None,
+        **stats
+    }
+
+@app.get("/logs/{log_id}/profile", tags=["Logs"])
+def get_query_profile(log_id: int):
+    """Профиль DuckDB (операторы и время) для записи лога"""
+    try:
+        profile = db.get_profile(log_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"No profile for log #{log_id}")
+    return profile
+
+@app.get("/slow-queries", tags=["Logs"])
+def get_slow_queries(limit: int = Query(20, ge=1, le=100)):
+    """Шаблоны медленных запросов по суммарному времени (для pre-aggregation)"""
+    try:
+        queries = db.get_slow_queries(limit=limit)
+        return {
+            "count": len(queries),
+            "queries": queries
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/fingerprints", tags=["Logs"])
+def get_fingerprints(limit: int = Query(50, ge=1, le=1000)):
+    """Шаблоны SQL (литералы заменены на ?) с числом выполнений и prepared hits"""
+    fingerprints = db.get_fingerprint_stats(limit=limit)
+    return {
+        "count": len(fingerprints),
+        "fingerprints": fingerprints
+    }
+
+@app.get("/metrics", tags=["Metrics"])
+def get_metrics():
+    """Метрики backend (coalescing, NLP клиент, ресурсы DuckDB)"""
+    try:
+        duckdb_usage = db.get_resource_usage()
+    except Exception as e:
+        duckdb_usage = {"error": str(e)}
+    
+    return {
+        "coalescing": {
+            "nlp": nlp_flight.stats(),
+            "sql": sql_flight.stats()
+        },
+        "nlp_client": nlp_client.stats(),
+        "duckdb": duckdb_usage
+    }
+
 @app.post("/clear-history", tags=["Utility"])
 def clear_conversation_history():
     """Очистить историю разговора с NLP моделью"""
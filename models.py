@@ -2,7 +2,7 @@
 Pydantic модели для валидации данных
 """
 from pydantic import BaseModel, Field
-from typing import List, Optional, Any, Dict
+from typing import List, Optional, Any, Dict, Literal
 
 # ============================================
 # REQUEST MODELS
@@ -11,6 +11,13 @@ from typing import List, Optional, Any, Dict
 class QueryRequest(BaseModel):
     """Запрос от Frontend"""
     query: str = Field(..., min_length=1, description="User question in natural language")
+    approximate: bool = Field(False, description="Answer from a table sample with scaled COUNT/SUM")
+    sample_rate: Optional[float] = Field(None, gt=0, le=1, description="Minimum sample fraction for approximate mode")
+    progressive: bool = Field(False, description="Stream refined NDJSON answers up to the exact one")
+    profile: bool = Field(False, description="Capture a DuckDB operator profile for this query")
+    format: Literal["records", "columnar", "rows"] = Field(
+        "records", description="records: list of objects; columnar: array per column; rows: array per row"
+    )
     
     class Config:
         json_schema_extra = {
@@ -27,11 +34,21 @@ class QueryResponse(BaseModel):
     """Ответ пользователю"""
     success: bool = Field(..., description="Whether query was successful")
     sql: str = Field(..., description="Generated SQL query")
-    results: List[Dict[str, Any]] = Field(default_factory=list, description="Query results")
+    results: List[Dict[str, Any]] = Field(default_factory=list, description="Query results (records format)")
     columns: List[str] = Field(default_factory=list, description="Column names")
+    column_types: Optional[List[str]] = Field(None, description="DuckDB column types (columnar/rows formats)")
+    data: Optional[List[List[Any]]] = Field(None, description="Values per column (columnar format)")
+    rows: Optional[List[List[Any]]] = Field(None, description="Values per row (rows format)")
+    format: str = Field("records", description="Format of the results")
     count: int = Field(..., description="Number of rows returned")
     execution_time: float = Field(..., description="Total execution time in seconds")
     error: Optional[str] = Field(None, description="Error message if failed")
+    approximate: bool = Field(False, description="Whether results are estimated from a sample")
+    sample_rate: Optional[float] = Field(None, description="Sample fraction used for the estimate")
+    error_margins: Optional[List[Optional[float]]] = Field(
+        None, description="Relative 95% margin of error of COUNT/SUM per row"
+    )
+    log_id: Optional[int] = Field(None, description="Audit log id (see /logs/{id}/profile)")
 
 class HealthResponse(BaseModel):
     """Статус работоспособности"""
@@ -45,11 +62,34 @@ class ExamplesResponse(BaseModel):
     """Примеры запросов"""
     examples: List[str]
 
+class ColumnValue(BaseModel):
+    """Значение колонки с частотой"""
+    value: str
+    count: int
+
+class ColumnStats(BaseModel):
+    """Статистика колонки из каталога"""
+    type: str
+    null_fraction: float
+    min: Optional[str] = None
+    max: Optional[str] = None
+    approx_distinct: int
+    top_values: Optional[List[ColumnValue]] = None
+
 class SchemaResponse(BaseModel):
     """Схема таблицы"""
     table: str
     columns: Dict[str, str]
     total_rows: int
+    catalog_version: Optional[int] = None
+    built_at: Optional[str] = None
+    column_stats: Dict[str, ColumnStats] = Field(default_factory=dict)
+
+class ColumnValuesResponse(BaseModel):
+    """Значения колонки для автодополнения"""
+    column: str
+    prefix: str
+    values: List[ColumnValue]
 
 class LogEntry(BaseModel):
     """Запись лога"""
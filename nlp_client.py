@@ -1,29 +1,179 @@
 """
 Клиент для взаимодействия с NLP моделью на HuggingFace
 """
+import threading
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
 from gradio_client import Client
-from typing import Optional
+from typing import Optional, List, Dict, Any
 from logger import logger
 from config import settings
+from resilience import CircuitBreaker, CircuitOpenError, RetryBudget, LatencyTracker
+
+class _PoolSlot:
+    """Один gradio_client.Client в пуле"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.client = None
+        self.lock = threading.Lock()
+
+class ClientPool:
+    """
+    Клиенты Gradio по одному или нескольким Space URL
+
+    Клиент не занимается эксклюзивно: Client.submit не блокирует и ведет
+    несколько job одновременно, поэтому клиенты выбираются по кругу.
+    """
+
+    def __init__(self, urls: List[str], size_per_url: int):
+        self.urls = urls
+        self.slots = [_PoolSlot(url) for url in urls for _ in range(max(1, size_per_url))]
+        self.breakers = {
+            url: CircuitBreaker(url, settings.nlp_breaker_failures, settings.nlp_breaker_reset)
+            for url in urls
+        }
+        self.in_flight = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, avoid_url: str = None) -> _PoolSlot:
+        """Следующий по кругу клиент, URL которого не закрыт circuit breaker"""
+        with self._lock:
+            order = self.slots[self._next:] + self.slots[:self._next]
+            self._next = (self._next + 1) % len(self.slots)
+            # Для hedge сначала другие реплики
+            order.sort(key=lambda s: s.url == avoid_url)
+            for slot in order:
+                if self.breakers[slot.url].allow():
+                    self.in_flight += 1
+                    return slot
+        raise CircuitOpenError("NLP model circuit is open")
+
+    def release(self, slot: _PoolSlot):
+        with self._lock:
+            self.in_flight -= 1
+
+    def connect(self, slot: _PoolSlot):
+        """Подключить клиент слота (вне блокировки пула)"""
+        with slot.lock:
+            if slot.client:
+                return
+            try:
+                logger.info(f"🔗 Connecting to NLP model: {slot.url}")
+                slot.client = Client(slot.url)
+                logger.info("✅ Connected to NLP model")
+            except Exception as e:
+                logger.error(f"❌ Failed to connect to NLP model: {e}")
+                self.breakers[slot.url].record_failure()
+                raise
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self.slots),
+            "in_flight": self.in_flight,
+            "connected": sum(1 for s in self.slots if s.client),
+            "breakers": {url: b.stats() for url, b in self.breakers.items()},
+        }
 
 class NLPClient:
     """Клиент для NLP модели на HuggingFace Gradio"""
     
     def __init__(self):
         self.space_url = settings.nlp_model_url
-        self.client = None
+        self.space_urls = [self.space_url] + [
+            url for url in settings.nlp_model_urls if url != self.space_url
+        ]
+        self.pool = ClientPool(self.space_urls, settings.nlp_pool_size)
+        self.retry_budget = RetryBudget(settings.nlp_retry_budget_ratio)
+        self.latency = LatencyTracker()
+        self.hedged = 0
+        self.hedge_wins = 0
         self.conversation_history = []
         self._connect()
     
     def _connect(self):
-        """Подключиться к Gradio Space"""
+        """Подключиться к Gradio Space (по одному клиенту на реплику, если breaker разрешает)"""
+        for url in self.space_urls:
+            slot = next(s for s in self.pool.slots if s.url == url)
+            breaker = self.pool.breakers[url]
+            if slot.client or not breaker.allow():
+                continue
+            try:
+                self.pool.connect(slot)
+                breaker.record_success()
+            except Exception:
+                pass
+    
+    def _submit(self, query: str, history: list, avoid_url: str = None):
+        """Отправить запрос через клиент из пула, вернуть (slot, job, start)"""
+        slot = self.pool.acquire(avoid_url=avoid_url)
         try:
-            logger.info(f"🔗 Connecting to NLP model: {self.space_url}")
-            self.client = Client(self.space_url)
-            logger.info("✅ Connected to NLP model")
-        except Exception as e:
-            logger.error(f"❌ Failed to connect to NLP model: {e}")
-            self.client = None
+            self.pool.connect(slot)
+            job = slot.client.submit(query, history, api_name="/handle_submit")
+        except Exception:
+            self.pool.release(slot)
+            raise
+        return slot, job, time.time()
+    
+    def _hedge_delay(self) -> Optional[float]:
+        """Задержка перед hedge-запросом: p95 латентности, не меньше минимума"""
+        if not settings.nlp_hedge_enabled:
+            return None
+        p95 = self.latency.percentile(95, min_samples=20)
+        return max(p95 or 0.0, settings.nlp_hedge_min_delay)
+    
+    def _call(self, query: str, history: list, deadline: float):
+        """Один вызов модели до deadline с опциональным hedge"""
+        calls = [self._submit(query, history)]
+        hedge_delay = self._hedge_delay()
+        hedge_call = None
+        last_error = None
+        
+        try:
+            while calls:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    for slot, _, _ in calls:
+                        self.pool.breakers[slot.url].record_failure()
+                    raise TimeoutError(f"NLP model timed out after {settings.nlp_timeout}s")
+                
+                wait_for = min(remaining, hedge_delay) if hedge_delay else remaining
+                done, _ = wait([job for _, job, _ in calls], timeout=wait_for,
+                               return_when=FIRST_COMPLETED)
+                
+                for call in [c for c in calls if c[1] in done]:
+                    slot, job, started = call
+                    calls.remove(call)
+                    self.pool.release(slot)
+                    try:
+                        result = job.result()
+                    except Exception as e:
+                        self.pool.breakers[slot.url].record_failure()
+                        last_error = e
+                        continue
+                    self.pool.breakers[slot.url].record_success()
+                    self.latency.record(time.time() - started)
+                    if call is hedge_call:
+                        self.hedge_wins += 1
+                    return result
+                
+                # Основной запрос медленнее p95 - отправить hedge
+                if not done and hedge_delay:
+                    hedge_delay = None
+                    try:
+                        hedge_call = self._submit(query, history, avoid_url=calls[0][0].url)
+                        calls.append(hedge_call)
+                        self.hedged += 1
+                        logger.info("🪞 Hedged NLP request sent")
+                    except Exception as e:
+                        logger.debug("Hedge skipped: %s", e)
+            
+            raise last_error
+        finally:
+            for slot, job, _ in calls:
+                job.cancel()
+                self.pool.release(slot)
     
     def generate_sql(self, query: str) -> str:
         """
@@ -35,21 +185,29 @@ class NLPClient:
         Returns:
             str: SQL запрос
         """
-        if not self.client:
-            self._connect()
-        
-        if not self.client:
-            raise Exception("NLP model is not available")
-        
-        logger.info(f"🤖 Generating SQL for query: '{query}'")
+        logger.debug("🤖 Generating SQL for query: '%s'", query)
+        self.retry_budget.deposit()
+        history = list(self.conversation_history)
+        attempt = 0
+        # Один таймаут на все попытки
+        deadline = time.time() + settings.nlp_timeout
         
         try:
-            # Вызов Gradio функции
-            result = self.client.predict(
-                query,
-                self.conversation_history,
-                api_name="/handle_submit"
-            )
+            while True:
+                try:
+                    # Вызов Gradio функции
+                    result = self._call(query, history, deadline)
+                    break
+                except CircuitOpenError:
+                    raise Exception("NLP model is not available (circuit open)")
+                except TimeoutError:
+                    raise
+                except Exception as e:
+                    if (attempt >= settings.nlp_max_retries or time.time() >= deadline
+                            or not self.retry_budget.try_withdraw()):
+                        raise
+                    attempt += 1
+                    logger.warning(f"🔁 NLP call failed ({e}), retry {attempt}/{settings.nlp_max_retries}")
             
             # result = (your_question, conversation)
             if isinstance(result, tuple) and len(result) >= 2:
@@ -68,7 +226,7 @@ class NLPClient:
                         sql = self._extract_sql(sql_response)
                         
                         if sql:
-                            logger.info(f"✅ Generated SQL: {sql[:100]}...")
+                            logger.debug("✅ Generated SQL: %.100s...", sql)
                             return sql
                         else:
                             raise Exception(f"Could not extract SQL from response")
@@ -124,11 +282,27 @@ class NLPClient:
     def health_check(self) -> bool:
         """Проверить доступность NLP модели"""
         try:
-            if not self.client:
-                self._connect()
-            return self.client is not None
+            for slot in self.pool.slots:
+                if slot.client and self.pool.breakers[slot.url].available():
+                    return True
+            # Нет подключенных клиентов - подключиться, если breaker разрешает
+            self._connect()
+            return any(
+                slot.client and self.pool.breakers[slot.url].available() for slot in self.pool.slots
+            )
         except:
             return False
+    
+    def stats(self) -> Dict[str, Any]:
+        """Метрики пула, circuit breaker, retry budget и hedge"""
+        p95 = self.latency.percentile(95)
+        return {
+            "pool": self.pool.stats(),
+            "retry_budget": self.retry_budget.stats(),
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "latency_p95": round(p95, 3) if p95 is not None else None,
+        }
 
 # Глобальный экземпляр
 nlp_client = NLPClient()
\ No newline at end of file
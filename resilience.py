@@ -0,0 +1,179 @@
+"""
+Примитивы устойчивости для внешних вызовов: circuit breaker, retry budget, latency tracker
+"""
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Optional
+
+class CircuitOpenError(Exception):
+    """Circuit breaker открыт - вызов отклонен без обращения к сервису"""
+
+class CircuitBreaker:
+    """
+    closed -> open после N ошибок подряд,
+    open -> half_open через reset_timeout секунд,
+    half_open -> closed после первого успеха (или снова open после ошибки)
+
+    В half_open пропускается один пробный вызов. Если его результат так и
+    не записан, через reset_timeout разрешается следующий.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = None
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def _probe_possible(self, now: float) -> bool:
+        if self.state == "open":
+            return now - self.opened_at >= self.reset_timeout
+        return self.probe_started is None or now - self.probe_started >= self.reset_timeout
+
+    def available(self) -> bool:
+        """Можно ли обращаться к сервису (без резервирования пробного вызова)"""
+        with self._lock:
+            return self.state == "closed" or self._probe_possible(time.time())
+
+    def allow(self) -> bool:
+        """Разрешить вызов; в half_open - только одному пробному вызову"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.time()
+            if not self._probe_possible(now):
+                return False
+            self.state = "half_open"
+            self.probe_started = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self.probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probe_started = None
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                self.state = "open"
+                self.opened_at = time.time()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened,
+        }
+
+class RetryBudget:
+    """
+    Ограничение доли retry: каждый запрос добавляет ratio токенов,
+    каждый retry тратит один токен
+    """
+
+    def __init__(self, ratio: float, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.retries = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.retries += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tokens": round(self.tokens, 2),
+            "retries": self.retries,
+            "rejected": self.rejected,
+        }
+
+class LatencyTracker:
+    """Скользящее окно латентностей для перцентилей"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+class WeightedSemaphore:
+    """
+    Семафор с весами: вызов занимает weight единиц из capacity,
+    тяжелые вызовы ждут, пока освободится достаточно места
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_use = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, weight: int, timeout: float) -> bool:
+        weight = min(weight, self.capacity)
+        deadline = time.time() + timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.in_use + weight > self.capacity:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        return False
+                    self._cond.wait(remaining)
+                self.in_use += weight
+                self.admitted += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self, weight: int):
+        weight = min(weight, self.capacity)
+        with self._cond:
+            self.in_use -= weight
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,56 @@
+"""
+Сериализация ответов: форматы results и компактный JSON без Pydantic валидации
+"""
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Dict, List
+from fastapi.responses import JSONResponse
+
+RESULT_FORMATS = ("records", "columnar", "rows")
+
+def _json_default(value: Any) -> Any:
+    """Типы DuckDB, которых нет в JSON"""
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+def dumps(body: Dict[str, Any]) -> str:
+    """Компактный JSON (без пробелов)"""
+    return json.dumps(body, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+
+class CompactJSONResponse(JSONResponse):
+    """JSON ответ без повторной валидации response_model"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content).encode("utf-8")
+
+def format_results(results: List[Dict], result_format: str) -> Dict[str, Any]:
+    """
+    Поля ответа с результатами в нужном формате
+
+    records  - список словарей (как раньше)
+    columnar - названия и типы колонок один раз, значения - массив на колонку
+    rows     - названия и типы колонок один раз, значения - массив на строку
+    """
+    columns = getattr(results, "columns", None)
+    if columns is None:
+        columns = list(results[0].keys()) if results else []
+
+    if result_format == "records":
+        return {"columns": columns, "results": results}
+
+    body = {
+        "columns": columns,
+        "column_types": getattr(results, "types", None),
+        "results": [],
+    }
+    if result_format == "columnar":
+        body["data"] = [[row[column] for row in results] for column in columns]
+    else:
+        body["rows"] = [[row[column] for column in columns] for row in results]
+    return body
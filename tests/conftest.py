@@ -0,0 +1,6 @@
+"""
+Общие настройки тестов: in-memory DuckDB вместо mastercard.db
+"""
+import os
+
+os.environ.setdefault("DATABASE_PATH", ":memory:")
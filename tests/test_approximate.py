@@ -0,0 +1,48 @@
+"""
+Тесты масштабирования агрегатов для approximate режима
+"""
+import pytest
+from approximate import scale_aggregates, _check_scalable
+
+def test_scales_count_and_sum():
+    sql, scaled = scale_aggregates("SELECT COUNT(*), SUM(x) FROM t", 10.0)
+    assert sql == "SELECT (COUNT(*) * 10.0), (SUM(x) * 10.0) FROM t"
+    assert scaled == ["COUNT", "SUM"]
+
+def test_count_distinct_is_not_scaled():
+    sql, scaled = scale_aggregates("SELECT COUNT(DISTINCT x) FROM t", 10.0)
+    assert sql == "SELECT COUNT(DISTINCT x) FROM t"
+    assert scaled == []
+
+def test_filter_is_inside_scaled_expression():
+    sql, _ = scale_aggregates(
+        "SELECT COUNT(*) FILTER (WHERE wallet_type IS NULL) AS n, COUNT(*) FROM t", 2.0
+    )
+    assert sql == "SELECT (COUNT(*) FILTER (WHERE wallet_type IS NULL) * 2.0) AS n, (COUNT(*) * 2.0) FROM t"
+
+def test_over_is_inside_scaled_expression():
+    sql, scaled = scale_aggregates(
+        "SELECT c, COUNT(*) * 100.0 / SUM(COUNT(*)) OVER () FROM t GROUP BY c", 2.0
+    )
+    assert sql == "SELECT c, (COUNT(*) * 2.0) * 100.0 / (SUM(COUNT(*)) OVER () * 2.0) FROM t GROUP BY c"
+    assert scaled == ["COUNT", "SUM"]
+
+def test_named_window_is_inside_scaled_expression():
+    sql, _ = scale_aggregates("SELECT SUM(x) OVER w FROM t WINDOW w AS (PARTITION BY c)", 2.0)
+    assert sql == "SELECT (SUM(x) OVER w * 2.0) FROM t WINDOW w AS (PARTITION BY c)"
+
+def test_check_scalable_accepts_top_level_aggregates():
+    _check_scalable("SELECT c, COUNT(*) FROM t WHERE x IN (1, 2) GROUP BY c")
+    _check_scalable("WITH s AS (SELECT * FROM t WHERE x > 1) SELECT COUNT(*) FROM s")
+
+@pytest.mark.parametrize("sql", [
+    "SELECT c FROM t",
+    "SELECT c FROM t GROUP BY c HAVING COUNT(*) > 5",
+    "SELECT AVG(cnt) FROM (SELECT c, COUNT(*) cnt FROM t GROUP BY c)",
+    "SELECT COUNT(*) FROM t WHERE c IN (SELECT c FROM t GROUP BY c HAVING COUNT(*) > 5)",
+    "SELECT COUNT(DISTINCT transaction_id), COUNT(*) FROM t",
+    "SELECT approx_count_distinct(card_id), COUNT(*) FROM t",
+])
+def test_check_scalable_rejects(sql):
+    with pytest.raises(ValueError):
+        _check_scalable(sql)
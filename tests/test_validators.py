@@ -0,0 +1,63 @@
+"""
+Тесты параметризации SQL (запуск из корня проекта: python -m pytest tests)
+"""
+import duckdb
+from validators import parameterize_sql, sql_fingerprint, sql_pattern
+
+def test_filter_where_does_not_leak_into_select_list():
+    sql = (
+        "SELECT COUNT(*) FILTER (WHERE transaction_type = 'REFUND') AS refunds, "
+        "ROUND(AVG(transaction_amount_kzt), 2) FROM example_dataset"
+    )
+    template, params = parameterize_sql(sql)
+    assert template == sql
+    assert params == []
+
+def test_subquery_restores_outer_clause():
+    template, params = parameterize_sql(
+        "SELECT (SELECT MAX(k) FROM u WHERE k < 5) AS m, ROUND(x, 2) FROM t WHERE y = 7 LIMIT 10"
+    )
+    assert template == "SELECT (SELECT MAX(k) FROM u WHERE k < 5) AS m, ROUND(x, 2) FROM t WHERE y = ? LIMIT ?"
+    assert params == ["7", "10"]
+
+def test_filter_literals_are_parameterized():
+    template, params = parameterize_sql(
+        "SELECT a FROM t WHERE city = 'Almaty' AND x IN (1, 2) AND d > DATE '2024-01-01'"
+    )
+    assert template == "SELECT a FROM t WHERE city = ? AND x IN (?, ?) AND d > DATE '2024-01-01'"
+    assert params == ["'Almaty'", "1", "2"]
+
+def test_fingerprint_ignores_filter_values():
+    assert sql_fingerprint("SELECT a FROM t WHERE b = 1") == sql_fingerprint("SELECT a FROM t WHERE b = 2")
+    assert sql_fingerprint("SELECT ROUND(a, 1) FROM t") != sql_fingerprint("SELECT ROUND(a, 2) FROM t")
+
+def test_pattern_keeps_literal_case():
+    assert sql_pattern("SELECT strftime(d, '%Y-%m') FROM t") != sql_pattern("SELECT strftime(d, '%y-%m') FROM t")
+    assert sql_pattern("SELECT COUNT(*) FILTER (WHERE c = 'REFUND') FROM t") == \
+        "select count(*) filter (where c = 'REFUND') from t"
+
+def test_pattern_normalizes_keyword_case_and_spaces():
+    assert sql_fingerprint("SELECT  A\nFROM t WHERE b = 1") == sql_fingerprint("select a from T where B = 2")
+
+def test_prepared_execution_keeps_column_names():
+    conn = duckdb.connect()
+    conn.execute("""
+        CREATE TABLE example_dataset AS
+        SELECT CASE WHEN i % 3 = 0 THEN 'REFUND' ELSE 'PURCHASE' END AS transaction_type,
+               i * 1.5 AS transaction_amount_kzt
+        FROM range(100) t(i)
+    """)
+    sql = (
+        "SELECT COUNT(*) FILTER (WHERE transaction_type = 'REFUND') AS refunds, "
+        "ROUND(AVG(transaction_amount_kzt), 2) FROM example_dataset WHERE transaction_amount_kzt > 10"
+    )
+    template, params = parameterize_sql(sql)
+
+    plain = conn.execute(sql)
+    plain_columns = [d[0] for d in plain.description]
+    plain_rows = plain.fetchall()
+
+    conn.execute(f"PREPARE plan_test AS {template}")
+    prepared = conn.execute(f"EXECUTE plan_test({', '.join(params)})")
+    assert [d[0] for d in prepared.description] == plain_columns
+    assert prepared.fetchall() == plain_rows
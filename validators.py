@@ -1,5 +1,6 @@
+import hashlib
 import re
-from typing import Tuple
+from typing import List, Tuple
 from logger import logger
 
 def validate_sql_security(sql: str) -> Tuple[bool, str]:
@@ -48,7 +49,7 @@ def validate_sql_security(sql: str) -> Tuple[bool, str]:
             logger.warning(f"⚠️ Injection pattern blocked: {message}")
             return False, message
     
-    logger.debug(f"✅ SQL validation passed")
+    logger.debug("✅ SQL validation passed")
     return True, ""
 
 def validate_sql_structure(sql: str) -> Tuple[bool, str]:
@@ -77,4 +78,74 @@ def sanitize_sql(sql: str) -> str:
     # Убрать точку с запятой в конце
     sql = sql.rstrip(";")
     
-    return sql
\ No newline at end of file
+    return sql
+
+# Токены SQL: строка, идентификатор в кавычках, число, слово, прочее
+_SQL_TOKEN = re.compile(r"""'(?:[^']|'')*'|"[^"]*"|\b\d+(?:\.\d+)?\b|\w+|\S""")
+_SQL_QUOTED = re.compile(r"""('(?:[^']|'')*'|"[^"]*")""")
+
+# Клаузы, где литералы - значения фильтров (остальные - часть "формы" запроса)
+_VALUE_CLAUSES = {"WHERE", "HAVING", "ON", "LIMIT", "OFFSET"}
+_CLAUSE_KEYWORDS = {"SELECT", "FROM", "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT",
+                    "OFFSET", "ON", "JOIN", "QUALIFY", "WINDOW", "UNION"}
+_TYPED_LITERAL_PREFIXES = {"DATE", "TIME", "TIMESTAMP", "TIMESTAMPTZ", "INTERVAL"}
+
+def parameterize_sql(sql: str) -> Tuple[str, List[str]]:
+    """
+    Вынести литералы фильтров (WHERE/HAVING/ON/LIMIT/OFFSET) в параметры
+    
+    Литералы внутри списка SELECT (в том числе в FILTER (WHERE ...) и
+    подзапросах в нем) не трогаются: из текста выражения DuckDB строит
+    название колонки.
+    
+    Returns:
+        (шаблон с ?, литералы в исходном SQL виде)
+    """
+    parts = []
+    params = []
+    clause = None
+    # Клаузы, в которых открыты вложенные скобки
+    outer = []
+    previous = None
+    pos = 0
+    
+    for match in _SQL_TOKEN.finditer(sql):
+        token = match.group(0)
+        upper = token.upper()
+        is_literal = token[0] == "'" or token[0].isdigit()
+        
+        if token == "(":
+            outer.append(clause)
+        elif token == ")":
+            if outer:
+                clause = outer.pop()
+        elif upper in _CLAUSE_KEYWORDS:
+            clause = upper
+        elif (is_literal and clause in _VALUE_CLAUSES and "SELECT" not in outer
+              and previous not in _TYPED_LITERAL_PREFIXES):
+            parts.append(sql[pos:match.start()])
+            parts.append("?")
+            params.append(token)
+            pos = match.end()
+        
+        previous = upper
+    
+    parts.append(sql[pos:])
+    return "".join(parts), params
+
+def sql_pattern(sql: str) -> str:
+    """
+    Шаблон SQL запроса: литералы фильтров заменены на ?, для группировки похожих запросов
+    """
+    template, _ = parameterize_sql(sql)
+    pattern = re.sub(r'\(\s*\?(?:\s*,\s*\?)+\s*\)', "(?)", template)
+    
+    # Регистр и пробелы нормализуются только вне кавычек: 'REFUND' и 'refund' - разные запросы
+    parts = _SQL_QUOTED.split(pattern)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r'\s+', " ", parts[i]).lower()
+    return "".join(parts).strip()
+
+def sql_fingerprint(sql: str) -> str:
+    """Короткий хеш шаблона SQL"""
+    return hashlib.sha1(sql_pattern(sql).encode("utf-8")).hexdigest()[:16]